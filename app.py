@@ -13,9 +13,10 @@ import logging
 
 logging.basicConfig(level=logging.INFO)
 
-from commands import IngTranscribeCommand, IngGPTCommand
-
-from control import ClientHandler, ClientFactory
+from control import ClientHandler, ClientFactory, ClientSupervisor, serve_metrics
+from shards import ShardSupervisor
+from job_manager.history import HistoryExport, HistoryTranscriber
+from client_registry import ClientRegistryWatcher, save_client_configs
 import typer
 
 app = typer.Typer()
@@ -26,6 +27,7 @@ os.makedirs(data_dir, exist_ok=True)
 clients_file_path = os.path.join(data_dir, 'clients.json') # path/to/clients.json
 
 if not os.path.exists(clients_file_path):
+    client_data = []
     with open(clients_file_path, 'w') as f:
         json.dump([], f)
 else:
@@ -48,13 +50,38 @@ def add_client(session: str):
             "session_name": session,
             "commands": ["IngTranscribeCommand", "IngGPTCommand"]
         }
+    # Log in here, where the phone number and code can be typed in; a running program never prompts.
+    asyncio.run(login_main(new_client))
     client_data.append(new_client)
-    # save json
-    with open(clients_file_path, 'w') as f:
-        json.dump(client_data, f, indent=4)
+    # save json, a running program picks the new client up
+    save_client_configs(clients_file_path, client_data)
 
     print(f"Added new client with session name: {session}")
 
+@app.command()
+def login(session: str):
+    """
+    Log in an existing client again, e.g. after its session was revoked. The running program picks it up on its
+    next reconnect.
+
+    :param session: str The session name of the client to log in.
+    :return: None
+    """
+    config = next((client for client in client_data if client.get("session_name") == session), None)
+    if config is None:
+        print(f"No client with session name: {session}")
+        raise typer.Exit(1)
+
+    asyncio.run(login_main(config))
+    print(f"Logged in client with session name: {session}")
+
+
+async def login_main(config):
+    handler = ClientFactory.create_client(config)
+    await handler.client.start()
+    await handler.client.disconnect()
+
+
 @app.command()
 def delete_client():
     print("Here are the available clients:")
@@ -65,40 +92,83 @@ def delete_client():
     client_data[:] = [client for client in client_data if client.get("session_name") != session]
     print(client_data)
 
-    with open(clients_file_path, 'w') as f:
-        json.dump(client_data, f, indent=4)
+    save_client_configs(clients_file_path, client_data)
     print(f"Deleted client with session name: {session}")
 
 
 @app.command()
-def start_program():
+def start_program(connect_concurrency: int = typer.Option(5, help="Maximum number of clients connecting at once"),
+                  shards: int = typer.Option(1, help="Number of worker processes to spread the clients over"),
+                  metrics_port: int = typer.Option(int(os.getenv("METRICS_PORT", 0)),
+                                                   help="Port of the /metrics endpoint, 0 to disable. "
+                                                        "Shard N listens on metrics_port + N"),
+                  watch: bool = typer.Option(True, help="Start and stop clients when clients.json changes")):
     """
-    Starts the main program after updating the client_data with added and/or deleted clients
+    Starts the main program after updating the client_data with added and/or deleted clients.
+    While it runs, add-client and delete-client take effect without a restart (unless --no-watch is given).
     :return: None
     """
-    loop = asyncio.get_event_loop()
+    registry_path = clients_file_path if watch else None
+    if shards > 1:
+        ShardSupervisor(client_data, shards, connect_concurrency=connect_concurrency, metrics_port=metrics_port,
+                        registry_path=registry_path).run()
+        return
 
     try:
-        # Schedule the main coroutine and the do_nothing coroutine
-        asyncio.ensure_future(main())
-        asyncio.ensure_future(do_nothing())
-
-        loop.run_forever()
+        asyncio.run(main(connect_concurrency, metrics_port, registry_path))
     except KeyboardInterrupt:
-        loop.stop()
-
+        pass
 
-async def main():
-    client_handlers = {}
-    for config in client_data:
-        client = ClientFactory.create_client(config)
-        await client.start()
-    print("bot started")
 
+@app.command()
+def transcribe_history(session: str, chat: str,
+                       output: str = typer.Option(None, help="Export path, .jsonl or .sqlite3. "
+                                                             "Defaults to data/history/<session>_<chat>.jsonl"),
+                       workers: int = typer.Option(4, help="Number of messages transcribed at once"),
+                       limit: int = typer.Option(None, help="Only look at the most recent LIMIT voice/video notes")):
+    """
+    Transcribes the voice and video notes already in a chat's history and exports the results.
+    Running it again on the same export resumes where the previous run stopped.
 
-async def do_nothing():
-    while True:
-        await asyncio.sleep(1)
+    :param session: str The session name of the client to read the history with.
+    :param chat: str The username, link or id of the chat.
+    :return: None
+    """
+    config = next((client for client in client_data if client.get("session_name") == session), None)
+    if config is None:
+        print(f"No client with session name: {session}")
+        raise typer.Exit(1)
+
+    output = output or os.path.join(data_dir, "history", f"{session}_{chat.lstrip('@')}.jsonl")
+    stats = asyncio.run(transcribe_history_main(config, int(chat) if chat.lstrip("-").isdigit() else chat,
+                                                output, workers, limit))
+    print(f"Exported to {output}")
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+async def transcribe_history_main(config, chat, output, workers, limit):
+    handler = ClientFactory.create_client(config)
+    export = HistoryExport(output)
+    try:
+        async with handler.client:
+            return await HistoryTranscriber(handler, chat, export, workers=workers, limit=limit).run()
+    finally:
+        export.close()
+
+
+async def main(connect_concurrency=5, metrics_port=0, registry_path=None):
+    supervisor = ClientSupervisor(client_data, max_concurrent_connects=connect_concurrency)
+    if metrics_port:
+        await serve_metrics(supervisor, metrics_port)
+    if registry_path:
+        watcher = asyncio.ensure_future(ClientRegistryWatcher(registry_path, supervisor.apply).watch())
+    print("bot started")
+    try:
+        await supervisor.run()
+    finally:
+        if registry_path:
+            watcher.cancel()
 
 
 if __name__ == "__main__":
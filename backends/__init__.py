@@ -0,0 +1,7 @@
+# backends/__init__.py
+
+from .base import TranscriptionBackend
+from .api_pool import ApiClientPool
+from .openai_backend import OpenAIBackend
+from .local_whisper import LocalWhisperBackend
+from .factory import BackendFactory
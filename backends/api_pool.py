@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+import openai
+
+from metrics import Histogram, metrics
+from outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: grows by one per window of successful requests and halves on overload.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._condition = None
+
+    async def __aenter__(self):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        self.limit = max(self.minimum, self.limit / 2)
+
+
+class ApiKey:
+    def __init__(self, key, requests_per_minute=50):
+        self.key = key
+        self.bucket = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.limiter = AdaptiveLimiter()
+        self.histogram = Histogram()
+        self.errors = 0
+
+    @property
+    def label(self):
+        return "..." + self.key[-4:]
+
+
+class ApiClientPool:
+    """
+        Shared client for OpenAI requests.
+
+        Requests reuse one keep-alive aiohttp session, are spread over several API keys with per-key quotas,
+        and run under a per-key AIMD concurrency limit that halves on 429/5xx responses. Failed requests are
+        retried with backoff only while retries stay within `retry_budget` of all requests, so an outage
+        doesn't multiply the load.
+
+        Methods:
+        --------
+        request(function, *args, **kwargs) -> Any:
+            Awaits function(*args, api_key=..., **kwargs) on the least loaded key. `timeout` bounds every attempt
+            with asyncio.wait_for, since openai overrides the session's timeout with its own per request; a
+            timed out attempt is retried like a 5xx.
+
+        get_metrics() -> dict:
+            Returns per-key concurrency limits, latency histograms and retry counters.
+    """
+    MAX_ATTEMPTS = 3
+    BACKOFF = 1
+
+    _shared = None
+
+    def __init__(self, api_keys, requests_per_minute=50, timeout=600, retry_budget=0.2, max_connections=32):
+        if not api_keys:
+            raise ValueError("No OpenAI API key configured")
+        self.keys = [ApiKey(key, requests_per_minute) for key in api_keys]
+        self.timeout = timeout
+        self.retry_budget = retry_budget
+        self.max_connections = max_connections
+        self._session = None
+        self._requests = 0
+        self._retries = 0
+
+    @classmethod
+    def from_env(cls):
+        api_keys = [key.strip() for key in os.getenv("OPENAI_API_KEYS", os.getenv("OPENAI_API_KEY", "")).split(",")
+                    if key.strip()]
+        return cls(api_keys, requests_per_minute=int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 50)),
+                   timeout=int(os.getenv("OPENAI_TIMEOUT", 600)))
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns the process-wide pool configured from the environment, shared by transcription and summaries.
+        """
+        if cls._shared is None:
+            cls._shared = cls.from_env()
+        return cls._shared
+
+    async def request(self, function, *args, **kwargs):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        openai.aiosession.set(self._session)
+
+        self._requests += 1
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            api_key = self._pick_key()
+            try:
+                await api_key.bucket.acquire()
+                async with api_key.limiter:
+                    started_at = time.monotonic()
+                    result = await asyncio.wait_for(function(*args, api_key=api_key.key, **kwargs), self.timeout)
+                    latency = time.monotonic() - started_at
+                    api_key.histogram.observe(latency)
+                    metrics.observe("telekit_openai_request_seconds", latency, key=api_key.label)
+                api_key.limiter.on_success()
+                return result
+            except (openai.error.OpenAIError, asyncio.TimeoutError) as e:
+                api_key.errors += 1
+                status = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e.http_status)
+                metrics.inc("telekit_openai_errors_total", key=api_key.label, status=status)
+                if not self._is_retryable(e):
+                    raise
+                if self._is_overload(e):
+                    api_key.limiter.on_overload()
+                if attempt == self.MAX_ATTEMPTS or self._retries >= self.retry_budget * self._requests:
+                    raise
+                self._retries += 1
+                logger.warning(f"OpenAI request failed on key {api_key.label} ({e!r}), retrying")
+                await asyncio.sleep(self.BACKOFF * 2 ** (attempt - 1))
+
+    def _pick_key(self):
+        return min(self.keys, key=lambda api_key: api_key.limiter.in_flight / api_key.limiter.limit)
+
+    @staticmethod
+    def _is_overload(error):
+        if isinstance(error, asyncio.TimeoutError):
+            return True
+        return isinstance(error, openai.error.RateLimitError) or (error.http_status or 0) >= 500
+
+    @classmethod
+    def _is_retryable(cls, error):
+        return cls._is_overload(error) or isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError,
+                                                               openai.error.ServiceUnavailableError))
+
+    def get_metrics(self):
+        return {
+            "requests": self._requests,
+            "retries": self._retries,
+            "keys": {api_key.label: {
+                "concurrency_limit": api_key.limiter.limit,
+                "in_flight": api_key.limiter.in_flight,
+                "errors": api_key.errors,
+                "latency": api_key.histogram.to_dict(),
+            } for api_key in self.keys},
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
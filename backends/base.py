@@ -0,0 +1,25 @@
+from abc import ABC, abstractmethod
+
+
+class TranscriptionBackend(ABC):
+    """
+    Speech-to-text engine used by VoiceJob.
+
+    `transcribe` returns a verbose answer in the shape of OpenAI's verbose_json response: a dict with
+    "duration" and a list of "segments" that each have "start", "end" and "text".
+    """
+    name = ""
+    # Errors worth retrying a chunk for.
+    retryable_errors = ()
+
+    @property
+    def cache_id(self):
+        """
+        Identifies the engine and model in cache, single-flight and checkpoint keys, so clients using
+        different backends never share results.
+        """
+        return self.name
+
+    @abstractmethod
+    async def transcribe(self, file, prompt="") -> dict:
+        pass
@@ -0,0 +1,37 @@
+import json
+
+from .openai_backend import OpenAIBackend
+from .local_whisper import LocalWhisperBackend
+
+
+class BackendFactory:
+    """
+        Creates transcription backends from the "transcription_backend" entry of a client in clients.json.
+
+        The entry is either a backend name ("openai", "local") or an object with a "name" and the backend's
+        constructor options, e.g. {"name": "local", "model": "small", "compute_type": "int8"}.
+        Backends with the same configuration are shared between clients.
+    """
+    backends = {
+        OpenAIBackend.name: OpenAIBackend,
+        LocalWhisperBackend.name: LocalWhisperBackend,
+    }
+    _instances = {}
+
+    @classmethod
+    def create_backend(cls, config=None):
+        if config is None:
+            config = OpenAIBackend.name
+        if isinstance(config, str):
+            config = {"name": config}
+
+        options = {key: value for key, value in config.items() if key != "name"}
+        # Options may hold lists or objects, so the key is their canonical JSON rather than a tuple of items.
+        key = (config["name"], json.dumps(options, sort_keys=True, default=str))
+        if key not in cls._instances:
+            backend_class = cls.backends.get(config["name"])
+            if backend_class is None:
+                raise ValueError(f"Unknown transcription backend {config['name']}")
+            cls._instances[key] = backend_class(**options)
+
+        return cls._instances[key]
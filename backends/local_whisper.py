@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .base import TranscriptionBackend
+
+logger = logging.getLogger(__name__)
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """
+    Runs faster-whisper on the CPU (int8 by default), so transcription doesn't depend on the network.
+
+    Models are loaded once per (model, device, compute type) and shared by every client. Requests run one at
+    a time on a single inference thread instead of several inferences competing for the same cores. With
+    faster-whisper >= 1.1 each request goes through its BatchedInferencePipeline, which decodes up to
+    `batch_size` speech chunks of the audio per forward pass; older versions decode the chunks one by one.
+    """
+    name = "local"
+
+    _models = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model="small", device="cpu", compute_type="int8", cpu_threads=0, batch_size=8):
+        self.model_name = model
+        self.device = device
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
+    @property
+    def cache_id(self):
+        return f"{self.name}:{self.model_name}:{self.compute_type}"
+
+    async def transcribe(self, file, prompt="") -> dict:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._transcribe_file, file, prompt)
+
+    def _transcribe_file(self, file, prompt):
+        model, pipeline = self._get_model()
+        if pipeline is not None and self.batch_size > 1:
+            segments, info = pipeline.transcribe(file, initial_prompt=prompt or None, beam_size=1,
+                                                 batch_size=self.batch_size)
+        else:
+            segments, info = model.transcribe(file, initial_prompt=prompt or None, beam_size=1)
+        return {
+            "duration": info.duration,
+            "language": info.language,
+            "segments": [{"start": segment.start, "end": segment.end, "text": segment.text}
+                         for segment in segments],
+        }
+
+    def _get_model(self):
+        key = (self.model_name, self.device, self.compute_type)
+        with self._models_lock:
+            if key not in self._models:
+                try:
+                    from faster_whisper import WhisperModel
+                except ImportError:
+                    raise ImportError("The local backend requires faster-whisper: pip install faster-whisper")
+                try:
+                    from faster_whisper import BatchedInferencePipeline
+                except ImportError:
+                    BatchedInferencePipeline = None
+
+                logger.info(f"Loading whisper model {self.model_name} ({self.device}, {self.compute_type})")
+                model = WhisperModel(self.model_name, device=self.device, compute_type=self.compute_type,
+                                     cpu_threads=self.cpu_threads)
+                pipeline = BatchedInferencePipeline(model=model) if BatchedInferencePipeline else None
+                self._models[key] = (model, pipeline)
+            return self._models[key]
@@ -0,0 +1,32 @@
+import openai
+
+from .api_pool import ApiClientPool
+from .base import TranscriptionBackend
+
+
+class OpenAIBackend(TranscriptionBackend):
+    name = "openai"
+    # ApiClientPool already retries within its retry budget.
+    retryable_errors = ()
+
+    def __init__(self, model="whisper-1", pool=None):
+        self.model = model
+        self._pool = pool
+
+    @property
+    def cache_id(self):
+        return f"{self.name}:{self.model}"
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ApiClientPool.shared()
+        return self._pool
+
+    async def transcribe(self, file, prompt="") -> dict:
+        return await self.pool.request(self._transcribe, file, prompt)
+
+    async def _transcribe(self, file, prompt, **request_options):
+        file.seek(0)
+        return await openai.Audio.atranscribe(self.model, file, response_format="verbose_json", prompt=prompt,
+                                              **request_options)
@@ -0,0 +1,65 @@
+# Compares the MP3 conversion with the Opus compaction stage on real media files.
+#
+#   python -m bench.compaction data/samples/*.ogg --transcribe
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+import typer
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import AudioHelper
+
+load_dotenv()
+app = typer.Typer()
+
+
+def _measure(convert, file_path, transcribe):
+    started = time.perf_counter()
+    output_path = convert(file_path)
+    converted = time.perf_counter()
+    measurement = {
+        "bytes_uploaded": os.path.getsize(output_path),
+        "convert_seconds": round(converted - started, 3),
+    }
+
+    if transcribe:
+        import openai
+
+        with open(output_path, 'rb') as file:
+            openai.Audio.transcribe("whisper-1", file, response_format="verbose_json")
+        measurement["transcribe_seconds"] = round(time.perf_counter() - converted, 3)
+
+    measurement["end_to_end_seconds"] = round(time.perf_counter() - started, 3)
+    return measurement
+
+
+@app.command()
+def main(files: List[str],
+         transcribe: bool = typer.Option(False, help="Also upload both variants to the API and time the requests"),
+         sample_rate: int = 16000,
+         bitrate: str = "32k"):
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        for file_path in files:
+            source = os.path.join(directory, os.path.basename(file_path))
+            shutil.copy(file_path, source)
+            report.append({
+                "file": file_path,
+                "source_bytes": os.path.getsize(file_path),
+                "mp3": _measure(AudioHelper._convert_media_to_mp3, source, transcribe),
+                "compact": _measure(lambda path: AudioHelper._compact_audio(path, sample_rate, bitrate), source,
+                                    transcribe),
+            })
+
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    app()
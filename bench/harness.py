@@ -0,0 +1,283 @@
+# Offline end-to-end benchmark: synthetic voice messages go through EventHandler.handle with a fake Telegram
+# client and a local mock of the OpenAI transcription endpoint.
+#
+#   python -m bench.harness --durations 5,30,300 --events 60 --concurrency 8 --output bench_output.json
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import count
+from types import SimpleNamespace
+
+import typer
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+app = typer.Typer()
+
+RESULT_MARKER = "bench transcript"
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def make_voice_file(directory, duration):
+    path = os.path.join(directory, f"voice_{duration}s.ogg")
+    if not os.path.exists(path):
+        subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i",
+                        f"sine=frequency=440:duration={duration}", "-ac", "1", "-c:a", "libopus", "-b:a", "32k",
+                        path], check=True)
+    return path
+
+
+class FakeDownloadIter:
+    """
+    Mirrors Telethon's download iterator: usable with `async for` directly or inside `async with`.
+    """
+
+    def __init__(self, generator):
+        self._generator = generator
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._generator.__anext__()
+
+    async def close(self):
+        await self._generator.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class FakeTelegramClient:
+    """
+    Stands in for TelegramClient: downloads are served from local files at a simulated bandwidth, and outgoing
+    requests only take a simulated round trip.
+    """
+
+    def __init__(self, files, bandwidth, round_trip, on_final_edit):
+        self.parse_mode = None
+        self.files = files
+        self.bandwidth = bandwidth
+        self.round_trip = round_trip
+        self.on_final_edit = on_final_edit
+
+    async def _round_trip(self):
+        await asyncio.sleep(self.round_trip)
+
+    async def download_media(self, message, file, progress_callback=None):
+        source = self.files[message.id]
+        size = os.path.getsize(source)
+        await asyncio.sleep(size / self.bandwidth)
+        shutil.copy(source, file)
+        if progress_callback:
+            await progress_callback(size, size)
+        return file
+
+    def iter_download(self, media, offset=0, limit=None, request_size=128 * 1024):
+        return FakeDownloadIter(self._iter_download(media, offset, limit, request_size))
+
+    async def _iter_download(self, media, offset, limit, request_size):
+        with open(self.files[media.message_id], "rb") as f:
+            f.seek(offset)
+            for index, data in enumerate(iter(lambda: f.read(request_size), b"")):
+                if limit is not None and index >= limit:
+                    break
+                await asyncio.sleep(len(data) / self.bandwidth)
+                yield data
+
+    async def edit_message(self, peer_id, message_id, text, **kwargs):
+        await self._round_trip()
+        if RESULT_MARKER in text and "Transcribing..." not in text:
+            self.on_final_edit(message_id)
+
+    async def send_message(self, peer_id, message, **kwargs):
+        await self._round_trip()
+
+    async def send_file(self, peer_id, file, **kwargs):
+        await self._round_trip()
+
+    async def delete_messages(self, peer_id, message_ids):
+        await self._round_trip()
+
+    async def get_messages(self, peer_id, ids=None):
+        await self._round_trip()
+        return None
+
+
+async def start_mock_transcription_server(port, latency_per_mb, base_latency):
+    from aiohttp import web
+
+    async def transcriptions(request):
+        size = 0
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "file":
+                size = len(await part.read())
+        await asyncio.sleep(base_latency + latency_per_mb * size / (1024 * 1024))
+        duration = size / 4000  # 32 kbit/s
+        return web.json_response({
+            "task": "transcribe",
+            "duration": duration,
+            "text": f" {RESULT_MARKER}",
+            "segments": [{"id": 0, "start": 0.0, "end": duration, "text": f" {RESULT_MARKER}"}],
+        })
+
+    application = web.Application(client_max_size=64 * 1024 * 1024)
+    application.router.add_post("/v1/audio/transcriptions", transcriptions)
+    runner = web.AppRunner(application)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def measure_loop_lag(samples, interval=0.01):
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started_at - interval)
+
+
+async def run_benchmark(durations, events, concurrency, bandwidth, round_trip, latency_per_mb, base_latency,
+                        mock_port, audio_directory, cache):
+    import openai
+
+    from backends import ApiClientPool, OpenAIBackend
+    from commands import get_command_spec
+    from control import ClientHandler
+    from job_manager.transcription_cache import transcription_cache
+
+    if not cache:
+        # Every synthetic message of the same duration has the same content, which would hit the cache.
+        transcription_cache.ttl = 0
+
+    openai.api_base = f"http://127.0.0.1:{mock_port}/v1"
+    runner = await start_mock_transcription_server(mock_port, latency_per_mb, base_latency)
+
+    files = {}
+    dispatched_at = {}
+    latencies = []
+    completions = {}
+
+    def on_final_edit(message_id):
+        if message_id in completions and not completions[message_id].done():
+            latencies.append(time.perf_counter() - dispatched_at[message_id])
+            completions[message_id].set_result(None)
+
+    client = FakeTelegramClient(files, bandwidth, round_trip, on_final_edit)
+    backend = OpenAIBackend(pool=ApiClientPool(["bench-key"], requests_per_minute=100000))
+    handler = ClientHandler(client, [get_command_spec("IngTranscribeCommand")], "bench", backend)
+
+    voice_files = {duration: make_voice_file(audio_directory, duration) for duration in durations}
+    message_ids = count(1)
+    lag_samples = []
+    lag_task = asyncio.ensure_future(measure_loop_lag(lag_samples))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_voice(duration):
+        async with semaphore:
+            message_id = next(message_ids)
+            files[message_id] = voice_files[duration]
+            # One chat per message, so the per-peer outbound rate limit doesn't dominate the latency.
+            message = SimpleNamespace(
+                id=message_id, peer_id=message_id, from_id=None, voice=True, message="", raw_text="",
+                date=datetime.now(timezone.utc), reply_to_msg_id=None,
+                media=SimpleNamespace(message_id=message_id),
+                document=SimpleNamespace(id=message_id, access_hash=0),
+                file=SimpleNamespace(duration=duration, size=os.path.getsize(voice_files[duration])))
+            completions[message_id] = asyncio.get_running_loop().create_future()
+            dispatched_at[message_id] = time.perf_counter()
+            await handler.handle_event(SimpleNamespace(message=message))
+            await completions[message_id]
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[send_voice(durations[index % len(durations)]) for index in range(events)])
+    elapsed = time.perf_counter() - started_at
+
+    lag_task.cancel()
+    await runner.cleanup()
+    await backend.pool.close()
+
+    return {
+        "events": events,
+        "concurrency": concurrency,
+        "durations": durations,
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": events / elapsed,
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "mean": statistics.mean(latencies) if latencies else None,
+        },
+        "event_loop_lag_seconds": {
+            "p99": percentile(lag_samples, 0.99),
+            "max": max(lag_samples, default=None),
+        },
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "cache": cache,
+        "streaming": os.getenv("STREAMING_PIPELINE") == "1",
+        "outbound": handler.outbound.get_metrics(),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIRECTORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@app.command()
+def main(durations: str = typer.Option("5,30,120", help="Comma separated voice message durations in seconds"),
+         events: int = typer.Option(30, help="Number of voice messages to send"),
+         concurrency: int = typer.Option(8, help="Voice messages in flight at the same time"),
+         bandwidth: float = typer.Option(4 * 1024 * 1024, help="Simulated download speed in bytes per second"),
+         round_trip: float = typer.Option(0.05, help="Simulated Telegram request round trip in seconds"),
+         latency_per_mb: float = typer.Option(2.0, help="Mock transcription time per uploaded MB"),
+         base_latency: float = typer.Option(0.3, help="Mock transcription time per request"),
+         mock_port: int = typer.Option(18080, help="Port of the mock transcription server"),
+         cache: bool = typer.Option(False, help="Let repeated messages hit the transcription cache"),
+         streaming: bool = typer.Option(False, help="Use the streaming ffmpeg pipeline"),
+         output: str = typer.Option("", help="Write the JSON report to this file instead of stdout")):
+    durations = [int(duration) for duration in durations.split(",")]
+    os.environ.setdefault("OPENAI_API_KEY", "bench-key")
+    if streaming:
+        os.environ["STREAMING_PIPELINE"] = "1"
+
+    # data/ and jobs/ are created relative to the working directory when the modules are imported.
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        report = asyncio.run(run_benchmark(durations, events, concurrency, bandwidth, round_trip, latency_per_mb,
+                                           base_latency, mock_port, directory, cache))
+        os.chdir(REPO_DIRECTORY)
+
+    report["commit"] = get_commit()
+    report_json = json.dumps(report, indent=4)
+    if output:
+        with open(output, "w") as f:
+            f.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def load_client_configs(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_client_configs(path, client_configs):
+    # Written to a temporary file and renamed, so a running watcher never reads a half-written registry.
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(client_configs, f, indent=4)
+    os.replace(temporary_path, path)
+
+
+class ClientRegistryWatcher:
+    """
+        Watches clients.json and hands every new version of it to a callback, e.g. ClientSupervisor.apply.
+
+        The file's mtime and size are polled every `interval` seconds, which needs no inotify support and also
+        works on bind-mounted Docker volumes. Versions that are not valid JSON are skipped.
+
+        Methods:
+        --------
+        watch():
+            Polls the registry until cancelled.
+    """
+
+    def __init__(self, path, on_change, interval=2, select=None):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        # Optional filter of the entries this process is responsible for.
+        self.select = select
+        self._signature = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+
+            try:
+                client_configs = load_client_configs(self.path)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Ignoring unreadable client registry {self.path}: {e}")
+                continue
+
+            if self.select:
+                client_configs = [config for config in client_configs if self.select(config)]
+            logger.info(f"Client registry changed, applying {len(client_configs)} client(s)")
+            try:
+                await self.on_change(client_configs)
+            except Exception:
+                logger.exception("Failed to apply the client registry")
@@ -1,5 +1,10 @@
 # commands/__init__.py
 
-from commands.ing_transcribe import IngTranscribeCommand
-from .ing_gpt import IngGPTCommand
+from .registry import COMMANDS, CommandSpec, get_command_spec
 
+
+def __getattr__(name):
+    # Command modules are imported on first use, see commands.registry.
+    if name in COMMANDS:
+        return COMMANDS[name].load()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -24,6 +24,14 @@ class Command (ABC):
     def get_identifiers(cls):
         return [cls.command_name] + cls.aliases
 
+    @classmethod
+    async def resume(cls, client_handler: 'ClientHandler', job_record):
+        """
+        Resumes a job of this command that was interrupted by a restart. Commands that don't persist
+        jobs can leave this as is.
+        """
+        pass
+
 # class Command:
 #     command_name = ""
 #     aliases = []
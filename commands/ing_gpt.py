@@ -1,10 +1,107 @@
+import logging
+from types import SimpleNamespace
+
 from .base import Command
+from telethon.utils import get_peer_id
+from job_manager.job_queue import job_queue
+from job_manager.job_store import job_store
+from job_manager.summary_job import SummaryJob
 
 
 class IngGPTCommand(Command):
+    """
+    This command summarizes the replied voice/video note or text, or splits it into chapters (-c).
+    """
     command_name = "@ingGPT"
     aliases = ["@gpt"]
+    MAX_MESSAGE_LENGTH = 4000
+
+    def __init__(self, event, client_handler):
+        super().__init__(event, client_handler)
+        self.peer_id = self.event.message.peer_id
+        self.summarize = False
+        self.create_chapters = False
+
+        self._message_to_prepend = f"[🐾](emoji/5460768917901285539) __{self.command_name}__\n\n"
+        self._status_message = "[❤️](emoji/5321387857527447505) __Summarizing...__[✨](emoji/5278352839272309494)"
 
     async def execute(self):
-        # Implementation
-        ...
+        await self.parse_args(self.event.message.message.split())
+        if not self.event.message.reply_to_msg_id:
+            await self.set_status("__Reply to a voice message or text to summarize it__")
+            return
+
+        await self.set_status(self._status_message)
+        message = await self.client_handler.get_message_by_id(self.peer_id, self.event.message.reply_to_msg_id)
+        if message is None:
+            await self.set_status("__The message is gone__")
+            return
+
+        summary_job = SummaryJob(self.client_handler, message, summary=self.summarize,
+                                 chapters=self.create_chapters)
+        await self.submit_job(summary_job)
+
+    async def submit_job(self, summary_job):
+        await job_store.create(summary_job.id, self.client_handler.session_name, self.command_name, {
+            "peer_id": get_peer_id(self.peer_id),
+            "message_id": self.event.message.id,
+            "target_message_id": self.event.message.reply_to_msg_id,
+            "summarize": self.summarize,
+            "create_chapters": self.create_chapters,
+        })
+        job_queue.submit(summary_job, self.complete_job)
+
+    async def complete_job(self, summary_job):
+        await job_store.set_state(summary_job.id, job_store.RUNNING)
+        try:
+            summary = await summary_job.process_job()
+        except ConnectionError:
+            # The job stays pending and is resumed once the client is connected again.
+            logging.warning(f"Client disconnected during job {summary_job.id}, it will be resumed")
+            raise
+        except Exception as e:
+            logging.error(f"Failed to summarize message {self.event.message.reply_to_msg_id}: {e}")
+            await job_store.set_state(summary_job.id, job_store.FAILED)
+            await self.set_status("__Summarizing failed__")
+            return
+
+        await self.send_result(summary.render())
+        await job_store.set_state(summary_job.id, job_store.DONE)
+
+    @classmethod
+    async def resume(cls, client_handler, job_record):
+        data = job_record["data"]
+        message = await client_handler.get_message_by_id(data["peer_id"], data["message_id"])
+        target_message = await client_handler.get_message_by_id(data["peer_id"], data["target_message_id"])
+        if message is None or target_message is None:
+            logging.warning(f"Messages of job {job_record['id']} are gone, dropping it")
+            await job_store.set_state(job_record["id"], job_store.FAILED)
+            return
+
+        # The command message already shows the status, so the options come from the job record.
+        command = cls(SimpleNamespace(message=message), client_handler)
+        command.summarize = data["summarize"]
+        command.create_chapters = data["create_chapters"]
+
+        logging.info(f"Resuming job {job_record['id']}")
+        summary_job = SummaryJob(client_handler, target_message, summary=command.summarize,
+                                 chapters=command.create_chapters, job_id=job_record["id"])
+        job_queue.submit(summary_job, command.complete_job)
+
+    async def send_result(self, text):
+        if len(text) > self.MAX_MESSAGE_LENGTH:
+            await self.client_handler.send_text_as_file(self.peer_id, text, "summary.txt",
+                                                        reply_to=self.event.message.reply_to_msg_id)
+            await self.client_handler.delete_message(self.peer_id, self.event.message.id)
+        else:
+            await self.set_status(self._message_to_prepend + text)
+
+    async def set_status(self, status):
+        await self.client_handler.edit_message(self.peer_id, self.event.message.id, status)
+
+    async def parse_args(self, args):
+        for arg in args:
+            if arg in ("-s", "--summarize"):
+                self.summarize = True
+            elif arg in ("-c", "--chapters"):
+                self.create_chapters = True
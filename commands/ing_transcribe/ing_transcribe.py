@@ -1,9 +1,15 @@
 import logging
+from types import SimpleNamespace
 
 from commands.base import Command
 import datetime
 from telethon.tl.types import Message
+from telethon.utils import get_peer_id
 from job_manager.voice_job import VoiceJob
+from job_manager.job_queue import job_queue
+from job_manager.job_store import job_store
+from job_manager.summarizer import summarizer
+from utils import EditThrottle
 
 
 class IngTranscribeCommand(Command):
@@ -12,6 +18,11 @@ class IngTranscribeCommand(Command):
     """
     command_name = "@ingTranscribe"
     aliases = ["@"]
+    # Telegram messages are capped at 4096 characters and voice captions at 1024, so partial results only
+    # show their tail.
+    MAX_PROGRESS_LENGTH = 3500
+    MAX_PROGRESS_CAPTION_LENGTH = 900
+    MAX_MESSAGE_LENGTH = 4000
 
     def __init__(self, event, client_handler):
         super().__init__(event, client_handler)
@@ -26,6 +37,7 @@ class IngTranscribeCommand(Command):
 
         self._message_to_prepend = f"[🐾](emoji/5460768917901285539) __{self.command_name}__\n\n"
         self._status_message = "[❤️](emoji/5321387857527447505) __Transcribing...__[✨](emoji/5278352839272309494)"
+        self._progress = EditThrottle(self._edit_progress)
 
     @property
     def message_to_prepend(self):
@@ -57,11 +69,104 @@ class IngTranscribeCommand(Command):
         await self.client_handler.edit_message(self.peer_id, self.event.message.id,
                                                self._status_message)
 
-        voice_job = VoiceJob(self.client_handler, self.event.message)
-        result = await voice_job.process_job()
-        plain_text = result.get_plain_text()
+        voice_job = VoiceJob(self.client_handler, self.event.message, progress_callback=self.report_progress)
+        await self.submit_job(voice_job, self.event.message.id)
+
+    async def submit_job(self, voice_job, media_message_id):
+        await job_store.create(voice_job.id, self.client_handler.session_name, self.command_name, {
+            "peer_id": get_peer_id(self.peer_id),
+            "message_id": self.event.message.id,
+            "media_message_id": media_message_id,
+            "format": self.format,
+            "summarize": self.summarize,
+            "create_chapters": self.create_chapters,
+            "send_as_new": self._send_as_new,
+        })
+        job_queue.submit(voice_job, self.complete_job)
+
+    async def complete_job(self, voice_job):
+        await job_store.set_state(voice_job.id, job_store.RUNNING)
+        try:
+            try:
+                result = await voice_job.process_job()
+            finally:
+                await self._progress.close()
+            await self.send_result(result)
+        except ConnectionError:
+            # The job stays pending and is resumed once the client is connected again.
+            logging.warning(f"Client disconnected during job {voice_job.id}, it will be resumed")
+            raise
+        except Exception:
+            await job_store.set_state(voice_job.id, job_store.FAILED)
+            try:
+                await self.client_handler.edit_message(self.peer_id, self.event.message.id,
+                                                       "__Transcribing failed__")
+            except Exception as e:
+                logging.error(f"Failed to show the failure of job {voice_job.id}: {e}")
+            raise
+        await job_store.set_state(voice_job.id, job_store.DONE)
+
+        if self.summarize or self.create_chapters:
+            await self.send_summary(result)
+
+    async def send_summary(self, result):
+        try:
+            summary = await summarizer.summarize(result, summary=self.summarize, chapters=self.create_chapters)
+        except Exception as e:
+            logging.error(f"Failed to summarize transcription: {e}")
+            return
+
+        text = summary.render()
+        if len(text) > self.MAX_MESSAGE_LENGTH:
+            await self.client_handler.send_text_as_file(self.peer_id, text, "summary.txt",
+                                                        reply_to=self.event.message.reply_to_msg_id)
+        else:
+            await self.client_handler.reply_message(self.peer_id, text, reply_to=self.event.message.reply_to_msg_id)
+
+    @classmethod
+    async def resume(cls, client_handler, job_record):
+        data = job_record["data"]
+        message = await client_handler.get_message_by_id(data["peer_id"], data["message_id"])
+        if data["media_message_id"] == data["message_id"]:
+            media_message = message
+        else:
+            media_message = await client_handler.get_message_by_id(data["peer_id"], data["media_message_id"])
+
+        if message is None or media_message is None:
+            logging.warning(f"Messages of job {job_record['id']} are gone, dropping it")
+            await job_store.set_state(job_record["id"], job_store.FAILED)
+            return
+
+        # The command message was already replaced by the status, so the options come from the job record.
+        command = cls(SimpleNamespace(message=message), client_handler)
+        command.format = data["format"]
+        command.summarize = data["summarize"]
+        command.create_chapters = data["create_chapters"]
+        command._send_as_new = data["send_as_new"]
+
+        logging.info(f"Resuming job {job_record['id']}")
+        voice_job = VoiceJob(client_handler, media_message, job_id=job_record["id"],
+                             progress_callback=command.report_progress)
+        job_queue.submit(voice_job, command.complete_job)
+
+    async def report_progress(self, stage, completed, total, text):
+        if stage == "download":
+            progress = f"{completed * 100 // total}%" if total else ""
+            status = f"[❤️](emoji/5321387857527447505) __Downloading... {progress}__"
+        else:
+            progress = f"{completed}/{total}" if total else f"{completed}"
+            status = f"[❤️](emoji/5321387857527447505) __Transcribing... {progress}__"
+
+        if text:
+            max_length = self.MAX_PROGRESS_CAPTION_LENGTH if self.is_voice_message() else self.MAX_PROGRESS_LENGTH
+            if len(text) > max_length:
+                text = "…" + text[-max_length:]
+            status = self.message_to_prepend + text + "\n\n" + status
+
+        self._progress.update(status)
 
-        await self.send_result(plain_text)
+    async def _edit_progress(self, text):
+        await self.client_handler.edit_message(self.peer_id, self.event.message.id, text)
 
     def is_from_peer(self):
         return self.peer_id == self.event.message.from_id or self.event.message.from_id is None
@@ -69,19 +174,22 @@ class IngTranscribeCommand(Command):
     async def send_result(self, result):
         if self.is_voice_message():
             await self.client_handler.edit_message(self.peer_id, self.event.message.id,
-                                                   self.message_to_prepend + result)
+                                                   self.message_to_prepend + result.get_plain_text())
             return
         elif self.format == "text":
             if self.edit_existing and self.is_from_peer():
                 await self.client_handler.edit_message(self.peer_id, self.event.message.reply_to_msg_id,
-                                                       self.message_to_prepend + result)
+                                                       self.message_to_prepend + result.get_plain_text())
             else:
-                await self.client_handler.reply_message(self.peer_id, self.message_to_prepend + result, reply_to=self.event.message.reply_to_msg_id )
+                await self.client_handler.reply_message(self.peer_id, self.message_to_prepend + result.get_plain_text(), reply_to=self.event.message.reply_to_msg_id )
         elif self.format == "file":
-            await self.client_handler.send_text_as_file(self.peer_id, result, "transcription.txt")
+            await self.client_handler.send_text_as_file(self.peer_id, result.get_plain_text(), "transcription.txt")
         elif self.format == "vtt":
-            await self.client_handler.reply_message(self.peer_id, "VTT format is not supported yet, sending as file", reply_to=self.event.message.reply_to_msg_id)
-            await self.client_handler.send_text_as_file(self.peer_id, result, "transcription.txt")
+            await self.client_handler.send_text_as_file(self.peer_id, result.get_vtt(), "transcription.vtt",
+                                                        reply_to=self.event.message.reply_to_msg_id)
+        elif self.format == "srt":
+            await self.client_handler.send_text_as_file(self.peer_id, result.get_srt(), "transcription.srt",
+                                                        reply_to=self.event.message.reply_to_msg_id)
 
         await self.remove_command_message()
 
@@ -102,10 +210,8 @@ class IngTranscribeCommand(Command):
 
         message_to_transcribe = await self.client_handler.get_message_by_id(self.peer_id,
                                                                             self.event.message.reply_to_msg_id)
-        voice_job = VoiceJob(self.client_handler, message_to_transcribe)
-        result = await voice_job.process_job()
-        plain_text = result.get_plain_text()
-        await self.send_result(plain_text)
+        voice_job = VoiceJob(self.client_handler, message_to_transcribe, progress_callback=self.report_progress)
+        await self.submit_job(voice_job, self.event.message.reply_to_msg_id)
 
 
     async def parse_args(self, args):
@@ -0,0 +1,40 @@
+import importlib
+
+
+class CommandSpec:
+    """
+    Describes a command without importing it. The command module is imported the first time `load` is called.
+    """
+    __slots__ = ("name", "module", "identifiers", "handles_voice", "_command_class")
+
+    def __init__(self, name, module, identifiers, handles_voice=False):
+        self.name = name
+        self.module = module
+        self.identifiers = tuple(identifiers)
+        self.handles_voice = handles_voice
+        self._command_class = None
+
+    def get_identifiers(self):
+        return list(self.identifiers)
+
+    def load(self):
+        if self._command_class is None:
+            command_class = getattr(importlib.import_module(self.module), self.name)
+            if set(command_class.get_identifiers()) != set(self.identifiers):
+                raise ValueError(f"Identifiers of {self.name} don't match its registry entry")
+            self._command_class = command_class
+        return self._command_class
+
+
+# Names used in the "commands" list of clients.json.
+COMMANDS = {spec.name: spec for spec in [
+    CommandSpec("IngTranscribeCommand", "commands.ing_transcribe", ["@ingTranscribe", "@"], handles_voice=True),
+    CommandSpec("IngGPTCommand", "commands.ing_gpt", ["@ingGPT", "@gpt"]),
+]}
+
+
+def get_command_spec(name) -> CommandSpec:
+    spec = COMMANDS.get(name)
+    if spec is None:
+        raise ValueError(f"Unknown command {name}")
+    return spec
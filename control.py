@@ -1,12 +1,22 @@
+import asyncio
 import os
+import re
+import time
 from io import BytesIO
 
 from telethon import TelegramClient, events
 from telethon.errors import MessageTooLongError, MediaCaptionTooLongError, MessageNotModifiedError, \
     MessageDeleteForbiddenError
 
-from commands import IngTranscribeCommand, IngGPTCommand
-from utils import CustomMarkdown
+from backends import ApiClientPool, BackendFactory
+from downloads import ParallelDownloader
+from outbound import create_outbound_scheduler
+from commands import CommandSpec, get_command_spec
+from job_manager.job_store import job_store
+from job_manager.job_queue import job_queue
+from job_manager.transcription_cache import transcription_cache
+from metrics import MetricsServer, metrics
+from utils import CustomMarkdown, audio_engine
 from functools import wraps
 
 import logging
@@ -14,6 +24,12 @@ import logging
 logging.basicConfig(level=logging.INFO)
 
 
+class ClientNotAuthorizedError(Exception):
+    """
+    Raised when a session isn't logged in. Logging in needs a phone code, so it's done from the CLI.
+    """
+
+
 def emoji_parser(func):
     @wraps(func)
     async def wrapper(self, *args, **kwargs):
@@ -42,72 +58,79 @@ class CommandFactory:
         return None
 
 
-class EventAdapter:
-    """
-        Adapter class that provides a consistent interface for working with events.
-
-        Attributes:
-        -----------
-        event: Event
-            The original event object being wrapped.
-
-        Methods:
-        --------
-        is_voice() -> bool:
-            Determines if the event contains a voice message.
-
-        get_message_text() -> str:
-            Retrieves the text message from the event.
-    """
-
-    def __init__(self, event):
-        self.event = event
-
-    def is_voice(self):
-        return self.event.message.voice
-
-    def get_message_text(self):
-        return self.event.message.message
-
-
 class CommandManager:
     """
         Manager class that handles the registration and retrieval of command classes.
 
+        The lookup tables are built once: an exact identifier map, the set of characters identifiers start
+        with, and the command that handles voice messages. Messages that can't be commands are rejected by
+        `match` without splitting their text.
+
         Attributes:
         -----------
         _commands: dict
-            Dictionary mapping command names to their corresponding classes.
+            Dictionary mapping command names to their corresponding specs or classes.
+
+        prefixes: set
+            First characters of all registered identifiers.
+
+        voice_command: str or None
+            Identifier of the command that handles voice messages.
 
         Methods:
         --------
-        register_command(command_class):
-            Registers a command class using its identifiers.
+        register_command(command):
+            Registers a command spec or class using its identifiers.
 
-        register_commands(command_classes):
-            Registers multiple command classes.
+        register_commands(commands):
+            Registers multiple commands.
 
         get_command(command_name) -> CommandClass:
-            Retrieves the command class for a given command name.
+            Retrieves the command class for a given command name, importing it on first use.
+
+        match(message) -> str or None:
+            Returns the identifier of the command the message invokes, if any.
         """
 
     def __init__(self, commands=None):
         self._commands = {}
+        self.prefixes = set()
+        self.voice_command = None
         if commands:
             self.register_commands(commands)
 
-    def register_command(self, command_class):
-        for identifier in command_class.get_identifiers():
+    def register_command(self, command):
+        identifiers = command.get_identifiers()
+        for identifier in identifiers:
             if identifier in self._commands:
                 raise ValueError(f"Command with identifier {identifier} already registered!")
-            self._commands[identifier] = command_class
+            self._commands[identifier] = command
+            self.prefixes.add(identifier[0])
+        if getattr(command, "handles_voice", False):
+            self.voice_command = identifiers[0]
+
+    def register_commands(self, commands):
+        for command in commands:
+            self.register_command(command)
 
-    def register_commands(self, command_classes):
-        for cmd_class in command_classes:
-            self.register_command(cmd_class)
+    def get_identifiers(self):
+        return list(self._commands)
 
     def get_command(self, command_name):
-        return self._commands.get(command_name)
+        command = self._commands.get(command_name)
+        if isinstance(command, CommandSpec):
+            return command.load()
+        return command
+
+    def match(self, message):
+        if message.voice:
+            return self.voice_command
+
+        text = message.message
+        if not text or text[0] not in self.prefixes:
+            return None
+        command_name = text.split(None, 1)[0]
+        return command_name if command_name in self._commands else None
 
 
 class EventHandler:
@@ -133,8 +156,7 @@ class EventHandler:
         self.command_manager = CommandManager(client_handler.command_classes)
 
     async def handle(self, event):
-        event_adapter = EventAdapter(event)
-        command_name = EventHandler.get_command_name(event_adapter)
+        command_name = self.command_manager.match(event.message)
         if not command_name:
             return
 
@@ -142,19 +164,6 @@ class EventHandler:
         if command:
             await command.execute()
 
-    @staticmethod
-    def get_command_name(event_adapter):
-        if not isinstance(event_adapter, EventAdapter):
-            raise TypeError(f"Expected an instance of EventAdapter, but got {type(event_adapter).__name__}.")
-
-        if event_adapter.is_voice():
-            return IngTranscribeCommand.command_name
-        else:
-            command_text = event_adapter.get_message_text()
-            if not command_text:
-                return None
-            return command_text.split()[0]
-
 
 class ClientHandler:
     """
@@ -165,6 +174,21 @@ class ClientHandler:
         client: Client
             The client instance being managed.
 
+        session_name: str
+            Name of the session in clients.json, used to find the client's persisted jobs.
+
+        transcription_backend: TranscriptionBackend
+            Speech-to-text engine used by the client's voice jobs.
+
+        outbound: OutboundScheduler
+            Rate limiter every outgoing message, edit and deletion goes through.
+
+        downloader: ParallelDownloader
+            Range downloader used for media larger than PARALLEL_DOWNLOAD_THRESHOLD.
+
+        allowed_chats / denied_chats: list or None
+            Chats (ids or usernames) the client only reacts in, or never reacts in.
+
         command_manager: CommandManager
             The command manager instance for the client.
 
@@ -173,49 +197,141 @@ class ClientHandler:
 
         Methods:
         --------
+        start():
+            Connects the client without prompting for a login, registers the event handlers once and
+            resumes pending jobs. Can be called again after a disconnect.
+
         handle_event(event):
             Processes the given event using the client's event handler.
 
+        resume_jobs():
+            Resumes the jobs that were interrupted by the last shutdown or disconnect. Jobs still running from
+            an earlier connection are resumed if they end without finishing.
+
         download_voice(message, filepath, callback) -> str or None:
             Downloads the voice message from the given message and saves it to the specified filepath.
     """
 
-    def __init__(self, client, command_classes):
+    PARALLEL_DOWNLOAD_THRESHOLD = 2 * 1024 * 1024
+
+    def __init__(self, client, command_classes, session_name=None, transcription_backend=None, allowed_chats=None,
+                 denied_chats=None):
+        if allowed_chats and denied_chats:
+            raise ValueError("A client can have either allowed_chats or denied_chats, not both")
+
         self.client = client
+        self.session_name = session_name
+        self.allowed_chats = allowed_chats
+        self.denied_chats = denied_chats
+        self.transcription_backend = transcription_backend or BackendFactory.create_backend()
+        self.outbound = create_outbound_scheduler()
+        self.downloader = ParallelDownloader(client, connections=int(os.getenv("DOWNLOAD_CONNECTIONS", 4)))
         client.parse_mode = CustomMarkdown()
         self.command_classes = command_classes
         self.event_handler = EventHandler(self)
+        self._handlers_registered = False
+        self._resuming = set()
 
     async def _register_event_handlers(self):
-        @self.client.on(events.NewMessage(incoming=False))
-        async def event_listener(event):
-            await self.handle_event(event)
+        # Telethon applies these filters before calling us, so messages that can't be commands and chats the
+        # client ignores never reach EventHandler.
+        command_manager = self.event_handler.command_manager
+        chat_filter = {"chats": self.allowed_chats or self.denied_chats, "blacklist_chats": bool(self.denied_chats)}
+
+        identifiers = sorted(command_manager.get_identifiers(), key=len, reverse=True)
+        if identifiers:
+            pattern = re.compile(r"(?:" + "|".join(map(re.escape, identifiers)) + r")(?:\s|$)")
+            self.client.add_event_handler(self.handle_event, events.NewMessage(
+                incoming=False, pattern=pattern, func=lambda event: not event.message.voice, **chat_filter))
+
+        if command_manager.voice_command:
+            self.client.add_event_handler(self.handle_event, events.NewMessage(
+                incoming=False, func=lambda event: bool(event.message.voice), **chat_filter))
 
         logging.info("ClientHandler initialized.")
 
     async def start(self):
-        await self._register_event_handlers()
+        # TelegramClient.start() would prompt for a phone number and code on stdin, blocking the event loop of
+        # every other client (or failing with EOFError in a shard), so unauthorized sessions are refused.
+        await self.client.connect()
+        if not await self.client.is_user_authorized():
+            await self.client.disconnect()
+            raise ClientNotAuthorizedError(
+                f"Session {self.session_name} is not logged in, run: python app.py login {self.session_name}")
+
+        if not self._handlers_registered:
+            await self._register_event_handlers()
+            self._handlers_registered = True
         await self.client.start()
+        await self.resume_jobs()
+
+    async def resume_jobs(self):
+        if self.session_name is None:
+            return
+
+        for job_record in await job_store.pending(self.session_name):
+            future = job_queue.get_future(job_record["id"])
+            if future is not None:
+                # Still running from an earlier connection, possibly of a replaced handler.
+                asyncio.ensure_future(self._resume_after(future, job_record))
+                continue
+            await self._resume_job(job_record)
+
+    async def _resume_after(self, future, job_record):
+        await asyncio.wait([future])
+        job_id = job_record["id"]
+        if not self.client.is_connected() or job_queue.is_active(job_id) or job_id in self._resuming:
+            return
+
+        self._resuming.add(job_id)
+        try:
+            # Jobs that lost their connection stay pending instead of failing.
+            if await job_store.get_state(job_id) in job_store.PENDING_STATES:
+                await self._resume_job(job_record)
+        finally:
+            self._resuming.discard(job_id)
+
+    async def _resume_job(self, job_record):
+        command_class = self.event_handler.command_manager.get_command(job_record["command_name"])
+        try:
+            await command_class.resume(self, job_record)
+        except ConnectionError:
+            logging.warning(f"Client disconnected while resuming job {job_record['id']}, retrying on reconnect")
+        except Exception:
+            logging.exception(f"Failed to resume job {job_record['id']}")
+            await job_store.set_state(job_record["id"], job_store.FAILED)
 
     async def handle_event(self, event):
         await self.event_handler.handle(event)
 
+    def _use_parallel_download(self, message):
+        media_file = getattr(message, "file", None)
+        return bool(media_file and media_file.size and media_file.size >= self.PARALLEL_DOWNLOAD_THRESHOLD)
+
     async def download_media(self, message, file, progress_callback=None) -> str or None:
+        if self._use_parallel_download(message):
+            return await self.downloader.download(message, file, progress_callback=progress_callback)
         return await self.client.download_media(message, file=file, progress_callback=progress_callback)
 
+    def iter_media(self, message, request_size=128 * 1024):
+        if self._use_parallel_download(message):
+            return self.downloader.iter_chunks(message)
+        return self.client.iter_download(message.media, request_size=request_size)
+
     async def send_text_as_file(self, peer_id, text, filename, reply_to=None):
-        text_bytes = text.encode('utf-8')
-        buffer = BytesIO(text_bytes)
-        buffer.name = filename  # Add a name attribute to the BytesIO object
-        buffer.seek(0)
+        def make_buffer():
+            buffer = BytesIO(text.encode('utf-8'))
+            buffer.name = filename  # Add a name attribute to the BytesIO object
+            return buffer
+
         if reply_to:
-            await self.client.send_file(peer_id, buffer, reply_to=reply_to)
+            await self.outbound.call(peer_id, lambda: self.client.send_file(peer_id, make_buffer(), reply_to=reply_to))
         else:
-            await self.client.send_file(peer_id, buffer)
+            await self.outbound.call(peer_id, lambda: self.client.send_file(peer_id, make_buffer()))
 
     async def delete_message(self, peer_id, message_id):
         try:
-            await self.client.delete_messages(peer_id, message_id)
+            await self.outbound.call(peer_id, lambda: self.client.delete_messages(peer_id, message_id))
         except MessageDeleteForbiddenError:
             logging.warning("Message delete forbidden")
 
@@ -223,8 +339,10 @@ class ClientHandler:
     async def edit_message(self, peer_id, message_id, new_text, parse_mode=None, link_preview=None, file=None,
                            force_document=None):
         try:
-            await self.client.edit_message(peer_id, message_id, new_text, link_preview=link_preview, file=file,
-                                           force_document=force_document, parse_mode=parse_mode)
+            async with metrics.stage("edit"):
+                await self.outbound.edit(peer_id, message_id, lambda: self.client.edit_message(
+                    peer_id, message_id, new_text, link_preview=link_preview, file=file,
+                    force_document=force_document, parse_mode=parse_mode))
         except MediaCaptionTooLongError:
             await self.send_text_as_file(peer_id, new_text, "transcription.txt")
         except MessageNotModifiedError:
@@ -237,8 +355,9 @@ class ClientHandler:
         if len(message) > 4096:
             await self.send_text_as_file(peer_id, message, "transcription.txt")
         else:
-            await self.client.send_message(peer_id, message, parse_mode=parse_mode, link_preview=link_preview,
-                                           file=file, force_document=force_document)
+            await self.outbound.call(peer_id, lambda: self.client.send_message(
+                peer_id, message, parse_mode=parse_mode, link_preview=link_preview, file=file,
+                force_document=force_document))
 
     @emoji_parser
     async def reply_message(self, peer_id, message, reply_to, parse_mode=None, link_preview=None, file=None,
@@ -246,8 +365,9 @@ class ClientHandler:
         if len(message) > 4096:
             await self.send_text_as_file(peer_id, message, "transcription.txt", reply_to=reply_to)
         else:
-            await self.client.send_message(peer_id, message, reply_to=reply_to, parse_mode=parse_mode,
-                                           link_preview=link_preview, file=file, force_document=force_document)
+            await self.outbound.call(peer_id, lambda: self.client.send_message(
+                peer_id, message, reply_to=reply_to, parse_mode=parse_mode, link_preview=link_preview, file=file,
+                force_document=force_document))
 
     async def get_message_by_id(self, peer_id, ids):
         return await self.client.get_messages(peer_id, ids=ids)
@@ -269,7 +389,145 @@ class ClientFactory():
         session_name = client_data.get("session_name")
         client = TelegramClient(sessions_location_directory + session_name + ".session", api_id, api_hash)
 
-        command_objects = [eval(command) for command in client_data['commands']]
-        handler = ClientHandler(client, command_objects)
+        command_specs = [get_command_spec(command) for command in client_data['commands']]
+        backend = BackendFactory.create_backend(client_data.get("transcription_backend"))
+        handler = ClientHandler(client, command_specs, session_name, backend,
+                                allowed_chats=client_data.get("allowed_chats"),
+                                denied_chats=client_data.get("denied_chats"))
 
         return handler
+
+
+class ClientSupervisor:
+    """
+        Supervisor that starts every configured client concurrently and keeps them running.
+
+        Attributes:
+        -----------
+        client_configs: list
+            Client entries from clients.json.
+
+        max_concurrent_connects: int
+            Maximum number of clients connecting/logging in at the same time.
+
+        handlers: dict
+            Session name -> running ClientHandler.
+
+        startup_times: dict
+            Session name -> seconds the last successful start took.
+
+        Methods:
+        --------
+        run():
+            Starts all clients and restarts failed or disconnected ones with exponential backoff.
+            Returns only when cancelled.
+
+        apply(client_configs):
+            Starts added clients, stops removed ones and restarts clients whose entry changed. Clients whose
+            entry is unchanged keep running.
+
+        get_metrics() -> dict:
+            Returns the running clients with their startup time and outbound scheduler metrics.
+    """
+    INITIAL_BACKOFF = 1
+
+    def __init__(self, client_configs, max_concurrent_connects=5, max_backoff=300):
+        self.client_configs = client_configs
+        self.max_concurrent_connects = max_concurrent_connects
+        self.max_backoff = max_backoff
+        self.handlers = {}
+        self.startup_times = {}
+        self._connect_semaphore = None
+        self._configs = {}
+        self._tasks = {}
+
+    def get_metrics(self):
+        return {
+            "running": len(self.handlers),
+            "client": {session_name: {
+                "startup_seconds": self.startup_times.get(session_name, 0.0),
+                **handler.outbound.get_metrics(),
+            } for session_name, handler in self.handlers.items()},
+        }
+
+    async def run(self):
+        self._connect_semaphore = asyncio.Semaphore(self.max_concurrent_connects)
+        await self.apply(self.client_configs)
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            for session_name in list(self._tasks):
+                await self._stop_client(session_name)
+
+    async def apply(self, client_configs):
+        configs = {config.get("session_name"): config for config in client_configs if config.get("session_name")}
+        for session_name in list(self._tasks):
+            if configs.get(session_name) != self._configs.get(session_name):
+                logging.info(f"Stopping client {session_name}")
+                await self._stop_client(session_name)
+
+        for session_name, config in configs.items():
+            if session_name not in self._tasks:
+                self._configs[session_name] = config
+                self._tasks[session_name] = asyncio.ensure_future(self._supervise(config))
+        self.client_configs = list(configs.values())
+
+    async def _stop_client(self, session_name):
+        task = self._tasks.pop(session_name)
+        self._configs.pop(session_name, None)
+        self.startup_times.pop(session_name, None)
+        task.cancel()
+        # Waits for the disconnect, so a restarted client doesn't open the session file twice.
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def _supervise(self, config):
+        session_name = config.get("session_name")
+        backoff = self.INITIAL_BACKOFF
+
+        # The handler is kept across reconnects, so jobs holding it keep working once it is connected again.
+        handler = None
+        while True:
+            try:
+                async with self._connect_semaphore:
+                    started_at = time.monotonic()
+                    if handler is None:
+                        handler = ClientFactory.create_client(config)
+                    await handler.start()
+                    self.startup_times[session_name] = time.monotonic() - started_at
+
+                logging.info(f"Client {session_name} started in {self.startup_times[session_name]:.2f}s")
+                self.handlers[session_name] = handler
+                backoff = self.INITIAL_BACKOFF
+
+                await handler.client.disconnected
+                logging.warning(f"Client {session_name} disconnected")
+            except asyncio.CancelledError:
+                raise
+            except ClientNotAuthorizedError as e:
+                logging.error(str(e))
+            except Exception:
+                logging.exception(f"Client {session_name} failed")
+            finally:
+                self.handlers.pop(session_name, None)
+                if handler:
+                    await handler.client.disconnect()
+
+            logging.info(f"Restarting client {session_name} in {backoff}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+async def serve_metrics(supervisor: ClientSupervisor, port):
+    """
+    Registers the runtime gauges and serves them with the stage timings on http://0.0.0.0:<port>/metrics.
+    """
+    metrics.register_gauges("telekit_job_queue", job_queue.get_metrics)
+    metrics.register_gauges("telekit_audio_engine", audio_engine.get_metrics)
+    metrics.register_gauges("telekit_transcription_cache", transcription_cache.get_metrics)
+    metrics.register_gauges("telekit_clients", supervisor.get_metrics)
+    metrics.register_gauges("telekit_openai", lambda: ApiClientPool._shared.get_metrics()
+                            if ApiClientPool._shared else {})
+
+    server = MetricsServer(metrics, port)
+    await server.start()
+    return server
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from telethon.tl.types import InputMessagesFilterRoundVoice
+
+from job_manager.transcription_cache import transcription_cache
+from job_manager.voice_job import VoiceJob
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryExport:
+    """
+        Compact export of transcribed history messages, written as JSON lines or to a SQLite table.
+
+        The export doubles as the checkpoint of a history run: messages it already contains are skipped
+        when the same chat is processed again.
+
+        Methods:
+        --------
+        done_ids() -> set[int]:
+            Returns the ids of the messages that are already exported.
+
+        write(message, result):
+            Appends the transcription of a message.
+
+        close():
+            Flushes and closes the underlying file or database.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._sqlite = os.path.splitext(path)[1] in (".sqlite", ".sqlite3", ".db")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if self._sqlite:
+            self._connection = sqlite3.connect(path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                "message_id INTEGER PRIMARY KEY, date INTEGER, sender_id INTEGER, duration INTEGER, "
+                "text TEXT NOT NULL)")
+            self._connection.commit()
+        else:
+            self._file = open(path, "a+", encoding="utf-8")
+
+    def done_ids(self):
+        if self._sqlite:
+            return {row[0] for row in self._connection.execute("SELECT message_id FROM transcripts")}
+
+        self._file.seek(0)
+        ids = set()
+        for line in self._file:
+            try:
+                ids.add(json.loads(line)["message_id"])
+            except (ValueError, KeyError):
+                # A line cut short by an interrupted run; the message is transcribed again.
+                continue
+        return ids
+
+    def write(self, message, result):
+        row = (message.id, int(message.date.timestamp()) if message.date else None, message.sender_id,
+               getattr(message.file, "duration", None), result.get_plain_text())
+        if self._sqlite:
+            self._connection.execute("INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?, ?)", row)
+            self._connection.commit()
+        else:
+            keys = ("message_id", "date", "sender_id", "duration", "text")
+            self._file.write(json.dumps(dict(zip(keys, row)), ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._sqlite:
+            self._connection.close()
+        else:
+            self._file.close()
+
+
+class HistoryTranscriber:
+    """
+        Transcribes the voice and video notes already in a chat's history.
+
+        Messages are paged with `iter_messages` and fed through a bounded queue to `workers` concurrent
+        VoiceJobs, so long histories never hold more than a few pending messages in memory. Results go
+        through the shared transcription cache and chunk checkpoints, so an interrupted run resumes
+        where it stopped.
+
+        Methods:
+        --------
+        run() -> dict:
+            Processes the history and returns throughput statistics.
+    """
+
+    def __init__(self, client_handler, chat, export, workers=4, limit=None, cache=None):
+        self.client_handler = client_handler
+        self.chat = chat
+        self.export = export
+        self.workers = workers
+        self.limit = limit
+        self.cache = cache or transcription_cache
+        self.stats = {"seen": 0, "skipped": 0, "cached": 0, "transcribed": 0, "failed": 0, "audio_seconds": 0}
+
+    async def run(self):
+        started_at = time.monotonic()
+        done_ids = self.export.done_ids()
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        try:
+            async for message in self.client_handler.client.iter_messages(
+                    self.chat, limit=self.limit, filter=InputMessagesFilterRoundVoice):
+                self.stats["seen"] += 1
+                if message.id in done_ids:
+                    self.stats["skipped"] += 1
+                    continue
+                await queue.put(message)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        elapsed = time.monotonic() - started_at
+        self.stats["elapsed_seconds"] = round(elapsed, 1)
+        self.stats["messages_per_minute"] = round(
+            (self.stats["cached"] + self.stats["transcribed"]) * 60 / elapsed, 1) if elapsed else 0
+        self.stats["audio_speedup"] = round(self.stats["audio_seconds"] / elapsed, 1) if elapsed else 0
+        return self.stats
+
+    async def _worker(self, queue):
+        while (message := await queue.get()) is not None:
+            try:
+                result = await self._transcribe(message)
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Failed to transcribe message {message.id}: {e}")
+                continue
+            self.export.write(message, result)
+            self.stats["audio_seconds"] += getattr(message.file, "duration", None) or 0
+
+    async def _transcribe(self, message):
+        result = await self.cache.get(self.cache.media_key(message, self.client_handler.transcription_backend))
+        if result is not None:
+            self.stats["cached"] += 1
+            return result
+
+        result = await VoiceJob(self.client_handler, message).process_job()
+        self.stats["transcribed"] += 1
+        return result
@@ -1,18 +1,32 @@
-import os
 import uuid
 from abc import ABC
 
+from job_manager.workspace import workspace
+
 
 class BaseJob(ABC):
-    def __init__(self, client_handler, message):
-        self._id = str(uuid.uuid4())
+    def __init__(self, client_handler, message, job_id=None):
+        self._id = job_id or str(uuid.uuid4())
         self._client_handler = client_handler
         self._message = message
 
-    def _create_job_directory(self) -> str:
-        job_directory = "jobs/" + self._id
-        if not os.path.exists(job_directory):
-            os.makedirs(job_directory)
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def client_id(self):
+        return id(self._client_handler)
+
+    @property
+    def priority(self):
+        return 0
+
+    async def _create_job_directory(self, expected_size=None) -> str:
+        return await workspace.create(self._id, expected_size)
 
-        return job_directory
+    async def _enforce_quota(self):
+        await workspace.enforce_quota()
 
+    async def _remove_job_directory(self):
+        await workspace.release(self._id)
@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+        In-process priority queue that runs jobs in the background so event handlers can return immediately.
+
+        Jobs with a lower `priority` value (for voice jobs, the duration in seconds) are started first.
+        At most `max_concurrent_jobs` run at once, and at most `max_jobs_per_client` for one client.
+
+        Methods:
+        --------
+        submit(job, coroutine_function) -> asyncio.Future:
+            Queues coroutine_function(job) and returns a future with its result.
+
+        is_active(job_id) -> bool:
+            Returns True if the job is queued or running in this process.
+
+        get_future(job_id) -> asyncio.Future or None:
+            Returns the future of an active job, to wait for it to end.
+
+        get_metrics() -> dict:
+            Returns queue depth, running jobs and wait time statistics.
+    """
+
+    def __init__(self, max_concurrent_jobs=4, max_jobs_per_client=2):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_jobs_per_client = max_jobs_per_client
+        self._pending = []
+        self._running = 0
+        self._running_per_client = {}
+        self._active = {}
+        self._counter = itertools.count()
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, job, coroutine_function) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._active[job.id] = future
+        self._pending.append((job.priority, next(self._counter), time.monotonic(), job, coroutine_function, future))
+        self._pending.sort(key=lambda entry: entry[:2])
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        waiting = []
+        for entry in self._pending:
+            client_id = entry[3].client_id
+            if (self._running >= self.max_concurrent_jobs
+                    or self._running_per_client.get(client_id, 0) >= self.max_jobs_per_client):
+                waiting.append(entry)
+                continue
+            self._start(entry)
+        self._pending = waiting
+
+    def _start(self, entry):
+        _, _, enqueued_at, job, coroutine_function, future = entry
+        wait = time.monotonic() - enqueued_at
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+        self._running += 1
+        self._running_per_client[job.client_id] = self._running_per_client.get(job.client_id, 0) + 1
+
+        task = asyncio.ensure_future(coroutine_function(job))
+        task.add_done_callback(lambda done: self._finish(job, done, future))
+
+    def _finish(self, job, task, future):
+        self._active.pop(job.id, None)
+        self._running -= 1
+        self._running_per_client[job.client_id] -= 1
+        if not self._running_per_client[job.client_id]:
+            del self._running_per_client[job.client_id]
+        self._completed += 1
+
+        if task.cancelled():
+            future.cancel()
+        elif task.exception() is not None:
+            logger.error(f"Job {job.id} failed", exc_info=task.exception())
+            if not future.done():
+                future.set_exception(task.exception())
+                # Already logged above, don't warn again if nobody awaits the future.
+                future.exception()
+        elif not future.done():
+            future.set_result(task.result())
+
+        self._dispatch()
+
+    def is_active(self, job_id):
+        return job_id in self._active
+
+    def get_future(self, job_id):
+        return self._active.get(job_id)
+
+    def get_metrics(self):
+        started = self._completed + self._running
+        return {
+            "queue_depth": len(self._pending),
+            "running": self._running,
+            "running_per_client": dict(self._running_per_client),
+            "completed": self._completed,
+            "average_wait": self._total_wait / started if started else 0.0,
+            "max_wait": self._max_wait,
+        }
+
+
+job_queue = JobQueue(int(os.getenv("JOB_CONCURRENCY", 4)), int(os.getenv("JOB_CONCURRENCY_PER_CLIENT", 2)))
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def connect(path, busy_timeout=30):
+    """
+    Opens a SQLite database shared by the event loop's worker threads and by the other shard processes.
+
+    WAL lets readers run next to the single writer, and the busy timeout makes concurrent writers wait
+    for each other instead of failing with "database is locked".
+    """
+    connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+    connection.execute(f"PRAGMA busy_timeout = {busy_timeout * 1000}")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+
+class JobStore:
+    """
+        Durable SQLite table of jobs and their completed chunk results, used to recover work after a restart.
+
+        Job states move from "queued" to "running" and end in "done" or "failed". Chunk results are
+        checkpointed under a checkpoint key so a resumed job only transcribes the chunks that are missing.
+
+        Methods:
+        --------
+        create(job_id, session_name, command_name, data):
+            Records a new queued job with the data its command needs to resume it.
+
+        set_state(job_id, state) / get_state(job_id) -> str or None:
+            Records a state transition and reads the current state.
+
+        pending(session_name) -> list[dict]:
+            Returns the unfinished jobs of a session, oldest first.
+
+        save_chunk(checkpoint_key, index, verbose_answer) / get_chunk(checkpoint_key, index) -> dict or None:
+            Stores and loads the API answer of a single chunk.
+
+        clear_chunks(checkpoint_key):
+            Drops the checkpoints once the full result is available.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    PENDING_STATES = (QUEUED, RUNNING)
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = connect(path)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, session_name TEXT NOT NULL, command_name TEXT NOT NULL, data TEXT NOT NULL, "
+            "state TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS jobs_session_state ON jobs (session_name, state);"
+            "CREATE TABLE IF NOT EXISTS job_chunks ("
+            "checkpoint_key TEXT NOT NULL, chunk_index INTEGER NOT NULL, verbose_answer TEXT NOT NULL, "
+            "PRIMARY KEY (checkpoint_key, chunk_index));")
+        self._connection.commit()
+
+    # Every write commits, so they run on a worker thread instead of the event loop.
+    async def create(self, job_id, session_name, command_name, data):
+        await asyncio.to_thread(self._create, job_id, session_name, command_name, data)
+
+    async def set_state(self, job_id, state):
+        await asyncio.to_thread(self._set_state, job_id, state)
+
+    async def get_state(self, job_id):
+        return await asyncio.to_thread(self._get_state, job_id)
+
+    async def pending(self, session_name):
+        return await asyncio.to_thread(self._pending, session_name)
+
+    async def save_chunk(self, checkpoint_key, index, verbose_answer):
+        await asyncio.to_thread(self._save_chunk, checkpoint_key, index, verbose_answer)
+
+    async def get_chunk(self, checkpoint_key, index):
+        return await asyncio.to_thread(self._get_chunk, checkpoint_key, index)
+
+    async def clear_chunks(self, checkpoint_key):
+        await asyncio.to_thread(self._clear_chunks, checkpoint_key)
+
+    def _create(self, job_id, session_name, command_name, data):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (id, session_name, command_name, data, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, session_name, command_name, json.dumps(data), self.QUEUED, now, now))
+            self._connection.commit()
+
+    def _set_state(self, job_id, state):
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?",
+                                     (state, time.time(), job_id))
+            self._connection.commit()
+        logger.debug(f"Job {job_id} is {state}")
+
+    def _get_state(self, job_id):
+        with self._lock:
+            row = self._connection.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def _pending(self, session_name):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, command_name, data FROM jobs WHERE session_name = ? AND state IN (?, ?) "
+                "ORDER BY created_at", (session_name, self.QUEUED, self.RUNNING)).fetchall()
+        return [{"id": job_id, "command_name": command_name, "data": json.loads(data)}
+                for job_id, command_name, data in rows]
+
+    def _save_chunk(self, checkpoint_key, index, verbose_answer):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO job_chunks (checkpoint_key, chunk_index, verbose_answer) VALUES (?, ?, ?)",
+                (checkpoint_key, index, json.dumps(verbose_answer)))
+            self._connection.commit()
+
+    def _get_chunk(self, checkpoint_key, index):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT verbose_answer FROM job_chunks WHERE checkpoint_key = ? AND chunk_index = ?",
+                (checkpoint_key, index)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _clear_chunks(self, checkpoint_key):
+        with self._lock:
+            self._connection.execute("DELETE FROM job_chunks WHERE checkpoint_key = ?", (checkpoint_key,))
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+job_store = JobStore(os.path.join("data", "jobs.sqlite3"))
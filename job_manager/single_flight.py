@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+        Coalesces concurrent calls for the same key into a single pending future.
+
+        Methods:
+        --------
+        do(key, coroutine_function) -> Any:
+            Runs coroutine_function() unless a call for the same key is already running, in which case the
+            result of that call is awaited instead. A key of None is never coalesced.
+
+        in_flight() -> int:
+            Returns the number of keys currently being processed.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    async def do(self, key, coroutine_function):
+        if key is None:
+            return await coroutine_function()
+
+        future = self._futures.get(key)
+        if future is None:
+            future = asyncio.ensure_future(coroutine_function())
+            self._futures[key] = future
+            future.add_done_callback(lambda _: self._futures.pop(key, None))
+        else:
+            logger.info(f"Joining in-flight job for {key}")
+
+        # Shielded so a cancelled caller doesn't cancel the work the other callers are waiting for.
+        return await asyncio.shield(future)
+
+    def in_flight(self):
+        return len(self._futures)
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+import openai
+
+from backends import ApiClientPool
+from job_manager.transcription_cache import transcription_cache
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for the languages we transcribe; good enough for budgeting.
+    return len(text) // 4 + 1
+
+
+def parse_timestamp(value):
+    if isinstance(value, str) and ":" in value:
+        seconds = 0
+        for part in value.strip("[]").split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    return float(value)
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class TokenBudget:
+    """
+    Upper bound on the estimated prompt and completion tokens one summary may spend. Cached windows are free.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.spent = 0
+
+    def charge(self, tokens):
+        if self.spent + tokens > self.limit:
+            raise BudgetExceeded(f"Token budget of {self.limit} exceeded")
+        self.spent += tokens
+
+
+class Summary:
+    def __init__(self, text=None, chapters=None, truncated=False, tokens=0):
+        self.text = text
+        self.chapters = chapters
+        self.truncated = truncated
+        self.tokens = tokens
+
+    def render(self):
+        parts = []
+        if self.text:
+            parts.append(self.text)
+        if self.chapters:
+            parts.append("\n".join(f"{format_timestamp(start)} {title}" for start, title in self.chapters))
+        if self.truncated:
+            parts.append("(Only the beginning fit into the token budget.)")
+        return "\n\n".join(parts)
+
+
+class TranscriptSummarizer:
+    """
+        Map-reduce summaries and chapters of long transcripts.
+
+        The transcript is cut into windows of whole segments of at most `window_tokens`. Every window is mapped
+        concurrently to a short summary plus chapter candidates, and the window results are cached by content,
+        so a summary and a chapter list of the same transcript (or a second request) share the map step.
+        Window summaries are then reduced hierarchically, in groups of at most REDUCE_TOKENS, until one is
+        left. Calls that would exceed `token_budget` are not made and the result is marked truncated.
+
+        Methods:
+        --------
+        summarize(result, summary=True, chapters=False) -> Summary:
+            Summarizes a TranscriptionResult and/or splits it into chapters.
+    """
+    MODEL = os.getenv("SUMMARY_MODEL", "gpt-3.5-turbo")
+    WINDOW_TOKENS = int(os.getenv("SUMMARY_WINDOW_TOKENS", 2500))
+    REDUCE_TOKENS = 3000
+    TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 60000))
+    MAX_CONCURRENT_WINDOWS = 4
+    MAX_OUTPUT_TOKENS = 400
+    MAX_CHAPTERS = 12
+
+    MAP_PROMPT = (
+        "You get a part of a transcript with [mm:ss] timestamps. Reply with JSON only, in the language of the "
+        'transcript: {"summary": "<2-4 sentences>", "chapters": [{"start": "<mm:ss>", "title": "<short title>"}]} '
+        "with one to three chapters where the topic changes.")
+    REDUCE_PROMPT = (
+        "Merge these consecutive partial summaries of one transcript into a single concise summary, in their "
+        "language. Reply with the summary only.")
+
+    def __init__(self, pool=None, cache=None, model=MODEL, window_tokens=WINDOW_TOKENS, token_budget=TOKEN_BUDGET):
+        self._pool = pool
+        self.cache = cache or transcription_cache
+        self.model = model
+        self.window_tokens = window_tokens
+        self.token_budget = token_budget
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ApiClientPool.shared()
+        return self._pool
+
+    async def summarize(self, result, summary=True, chapters=False) -> Summary:
+        budget = TokenBudget(self.token_budget)
+        windows = self._windows(result)
+        mapped = await self._map(windows, budget)
+        truncated = len(mapped) < len(windows)
+
+        output = Summary(truncated=truncated)
+        if summary and mapped:
+            try:
+                output.text = await self._reduce([window["summary"] for window in mapped], budget)
+            except BudgetExceeded:
+                output.text = "\n".join(window["summary"] for window in mapped)
+                output.truncated = True
+        if chapters:
+            output.chapters = self._merge_chapters(mapped)
+        output.tokens = budget.spent
+        return output
+
+    def _windows(self, result):
+        windows = []
+        lines = []
+        tokens = 0
+        for start, end, text in result.segments():
+            line = f"[{format_timestamp(start)}] {text.strip()}"
+            line_tokens = estimate_tokens(line)
+            if lines and tokens + line_tokens > self.window_tokens:
+                windows.append("\n".join(lines))
+                lines, tokens = [], 0
+            lines.append(line)
+            tokens += line_tokens
+        if lines:
+            windows.append("\n".join(lines))
+        return windows
+
+    def _cache_key(self, kind, text):
+        digest = hashlib.sha256(f"{self.model}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+        return f"summary:{kind}:{digest}"
+
+    async def _map(self, windows, budget):
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_WINDOWS)
+        mapped = []
+        tasks = {}
+        # The budget is charged in transcript order, so a truncated summary covers the beginning.
+        for window in windows:
+            key = self._cache_key("map", window)
+            cached = await self.cache.get_value(key)
+            if cached is None:
+                try:
+                    budget.charge(estimate_tokens(self.MAP_PROMPT + window) + self.MAX_OUTPUT_TOKENS)
+                except BudgetExceeded:
+                    logger.info(f"Token budget reached after {len(mapped)} of {len(windows)} windows")
+                    break
+                tasks[len(mapped)] = asyncio.ensure_future(self._map_window(key, window, semaphore))
+            mapped.append(cached)
+
+        try:
+            for index, window_result in zip(tasks, await asyncio.gather(*tasks.values())):
+                mapped[index] = window_result
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return mapped
+
+    async def _map_window(self, key, window, semaphore):
+        async with semaphore:
+            answer = await self._complete(self.MAP_PROMPT, window, stage="summary_map")
+        try:
+            mapped = json.loads(answer[answer.index("{"):answer.rindex("}") + 1])
+            mapped = {"summary": str(mapped.get("summary", "")),
+                      "chapters": [[parse_timestamp(chapter["start"]), str(chapter["title"])]
+                                   for chapter in mapped.get("chapters", [])]}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.warning("Window summary is not valid JSON, using it as plain text")
+            mapped = {"summary": answer.strip(), "chapters": []}
+        await self.cache.put_value(key, mapped)
+        return mapped
+
+    async def _reduce(self, summaries, budget):
+        while len(summaries) > 1:
+            groups = []
+            for summary in summaries:
+                if groups and estimate_tokens("\n\n".join(groups[-1] + [summary])) <= self.REDUCE_TOKENS:
+                    groups[-1].append(summary)
+                else:
+                    groups.append([summary])
+            if len(groups) == len(summaries):
+                # Every summary fills a group on its own; pair them up so the reduction still converges.
+                groups = [summaries[index:index + 2] for index in range(0, len(summaries), 2)]
+            summaries = await asyncio.gather(*[self._reduce_group(group, budget) for group in groups])
+        return summaries[0]
+
+    async def _reduce_group(self, group, budget):
+        if len(group) == 1:
+            return group[0]
+
+        text = "\n\n".join(group)
+        key = self._cache_key("reduce", text)
+        cached = await self.cache.get_value(key)
+        if cached is not None:
+            return cached
+
+        budget.charge(estimate_tokens(self.REDUCE_PROMPT + text) + self.MAX_OUTPUT_TOKENS)
+        summary = (await self._complete(self.REDUCE_PROMPT, text, stage="summary_reduce")).strip()
+        await self.cache.put_value(key, summary)
+        return summary
+
+    def _merge_chapters(self, mapped):
+        chapters = sorted(tuple(chapter) for window in mapped for chapter in window["chapters"])
+        if len(chapters) > self.MAX_CHAPTERS:
+            step = len(chapters) / self.MAX_CHAPTERS
+            chapters = [chapters[int(index * step)] for index in range(self.MAX_CHAPTERS)]
+        return chapters
+
+    async def _complete(self, system_prompt, text, stage):
+        async with metrics.stage(stage, model=self.model):
+            response = await self.pool.request(
+                openai.ChatCompletion.acreate, model=self.model, max_tokens=self.MAX_OUTPUT_TOKENS,
+                request_timeout=self.pool.timeout,
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": text}])
+        return response["choices"][0]["message"]["content"]
+
+
+summarizer = TranscriptSummarizer()
@@ -0,0 +1,39 @@
+from .job import BaseJob
+from job_manager.summarizer import Summary, summarizer as shared_summarizer
+from job_manager.transcription_result import TranscriptionResult
+from job_manager.voice_job import VoiceJob
+
+
+class SummaryJob(BaseJob):
+    """
+    Summarizes a voice/video note (transcribing it first, usually from the cache) or a text message.
+    """
+
+    def __init__(self, client_handler, message, summary=True, chapters=False, job_id=None, summarizer=None):
+        super().__init__(client_handler, message, job_id)
+        self._summary = summary
+        self._chapters = chapters
+        self._summarizer = summarizer or shared_summarizer
+
+    @property
+    def priority(self):
+        media_file = getattr(self._message, "file", None)
+        return getattr(media_file, "duration", None) or 0
+
+    async def process_job(self) -> Summary:
+        result = await self.get_transcription()
+        # Plain text has no timestamps to put chapters at.
+        chapters = self._chapters and result.duration > 0
+        return await self._summarizer.summarize(result, summary=self._summary or not chapters, chapters=chapters)
+
+    async def get_transcription(self) -> TranscriptionResult:
+        if self._message.voice or self._message.video_note:
+            # Runs inside this job's queue slot; a transcribed message is served from the cache.
+            return await VoiceJob(self._client_handler, self._message).process_job()
+
+        # Paragraphs of plain text become zero-length segments.
+        return TranscriptionResult({
+            "duration": 0,
+            "segments": [{"start": 0, "end": 0, "text": "\n" + paragraph}
+                         for paragraph in (self._message.raw_text or "").split("\n") if paragraph.strip()]
+        })
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from job_manager.job_store import connect
+from job_manager.transcription_result import TranscriptionResult
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionCache:
+    """
+        Persistent SQLite cache of serialized TranscriptionResult objects.
+
+        Entries expire after `ttl` seconds and the least recently used ones are evicted once the total
+        stored size exceeds `max_size` bytes.
+
+        Methods:
+        --------
+        get(key) -> TranscriptionResult or None:
+            Returns the cached result for the key and marks it as recently used.
+
+        put(key, result):
+            Stores the result under the key and evicts old entries if needed.
+
+        get_value(key) / put_value(key, value):
+            Same as get/put for any JSON-serializable value, e.g. the per-window summaries of a transcript.
+
+        media_key(message, backend=None) -> str or None:
+            Builds a key from the Telegram document of the message and the backend that transcribes it.
+
+        file_key(file_path, backend=None) -> str:
+            Builds a key from the SHA-256 of a file's contents and the backend that transcribes it.
+
+        get_metrics() -> dict:
+            Returns hit/miss counters and the current size of the cache.
+    """
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, ttl=30 * 24 * 3600):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS transcriptions ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS transcriptions_accessed_at ON transcriptions (accessed_at)")
+        self._connection.commit()
+
+    @staticmethod
+    def media_key(message, backend=None):
+        document = getattr(message, "document", None)
+        if document is None:
+            return None
+        # The access hash differs between accounts, so only the document id is used to share entries.
+        return TranscriptionCache._with_backend(f"document:{document.id}", backend)
+
+    @staticmethod
+    def file_key(file_path, backend=None):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return TranscriptionCache._with_backend(f"sha256:{digest.hexdigest()}", backend)
+
+    @staticmethod
+    def _with_backend(key, backend):
+        # Results of different engines or models are never served to each other's clients.
+        return f"{key}:{backend.cache_id}" if backend is not None else key
+
+    # Reads update accessed_at and writes evict, so every call runs on a worker thread.
+    async def get(self, key):
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key, result: TranscriptionResult):
+        await asyncio.to_thread(self._put, key, result)
+
+    async def get_value(self, key):
+        return await asyncio.to_thread(self._get_value, key)
+
+    async def put_value(self, key, value):
+        await asyncio.to_thread(self._put_value, key, value)
+
+    def _get(self, key):
+        value = self._get_value(key)
+        if value is None:
+            return None
+
+        logger.info(f"Transcription cache hit for {key}")
+        return TranscriptionResult.from_dict(value)
+
+    def _put(self, key, result: TranscriptionResult):
+        self._put_value(key, result.to_dict())
+
+    def _get_value(self, key):
+        if key is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM transcriptions WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE transcriptions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def _put_value(self, key, value):
+        if key is None:
+            return
+
+        value = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO transcriptions (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, value, len(value.encode("utf-8")), now, now))
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now):
+        self._connection.execute("DELETE FROM transcriptions WHERE created_at <= ?", (now - self.ttl,))
+        total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM transcriptions").fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        for key, size in self._connection.execute(
+                "SELECT key, size FROM transcriptions ORDER BY accessed_at").fetchall():
+            self._connection.execute("DELETE FROM transcriptions WHERE key = ?", (key,))
+            total_size -= size
+            if total_size <= self.max_size:
+                break
+
+    def get_metrics(self):
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcriptions").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "size": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+transcription_cache = TranscriptionCache(
+    os.path.join("data", "transcription_cache.sqlite3"),
+    max_size=int(os.getenv("CACHE_MAX_SIZE_MB", 64)) * 1024 * 1024,
+    ttl=int(os.getenv("CACHE_TTL_DAYS", 30)) * 24 * 3600)
@@ -1,33 +1,163 @@
+import os
+import re
+from array import array
+
+
 class TranscriptionResult:
-    def __init__(self, verbose_answer):
-        self._result = {
-            "segments": []
-        }
+    """
+        Segments of a transcription, stored as parallel start/end arrays over one text buffer.
+
+        Segment i spans `_text[_bounds[i]:_bounds[i + 1]]`, so a result costs a few bytes per segment on top of
+        its text instead of a dict per segment. The raw API answers (tokens, logprobs, ...) are only kept, in
+        `verbose_answers`, when `keep_verbose` is set or KEEP_VERBOSE_ANSWER=1.
+
+        Methods:
+        --------
+        add_verbose_answer(verbose_answer, offset=None):
+            Appends the answer of the next chunk.
+
+        segments() -> Iterator[tuple[float, float, str]]:
+            Yields (start, end, text) for every segment.
+
+        get_plain_text() -> str:
+            Returns the whole transcript.
+
+        get_srt() / get_vtt() -> str:
+            Renders the segments as SubRip or WebVTT subtitles.
+    """
+    __slots__ = ("duration", "verbose_answers", "_starts", "_ends", "_bounds", "_text")
+
+    # How many words at a chunk seam are compared when removing text repeated by the chunk overlap.
+    MAX_SEAM_WORDS = 30
+    KEEP_VERBOSE = os.getenv("KEEP_VERBOSE_ANSWER", "0") == "1"
+
+    def __init__(self, verbose_answer, keep_verbose=None):
         self.duration = verbose_answer["duration"]
-        self.verbose_answer = verbose_answer
-        for segment in verbose_answer["segments"]:
-            self._result["segments"].append({
-                "start": segment["start"],
-                "text": segment["text"]
-            })
-
-    def add_verbose_answer(self, verbose_answer):
-        for segment in verbose_answer["segments"]:
-            self._result["segments"].append({
-                "start": segment["start"] + self.duration,
-                "text": segment["text"]
-            })
-
-        self.duration += verbose_answer["duration"]
+        keep_verbose = self.KEEP_VERBOSE if keep_verbose is None else keep_verbose
+        self.verbose_answers = [verbose_answer] if keep_verbose else None
+        self._starts = array("d")
+        self._ends = array("d")
+        self._bounds = array("q", [0])
+        self._text = ""
+        self._append([(segment["start"], segment["end"], segment["text"])
+                      for segment in verbose_answer["segments"]])
 
-    def get_plain_text(self):
-        text = ""
-        for segment in self._result["segments"]:
-            text += segment["text"]
+    def _append(self, segments):
+        texts = []
+        length = len(self._text)
+        for start, end, text in segments:
+            self._starts.append(start)
+            self._ends.append(end)
+            length += len(text)
+            self._bounds.append(length)
+            texts.append(text)
+        self._text = "".join([self._text, *texts])
+
+    def __len__(self):
+        return len(self._starts)
+
+    def _segment_text(self, index):
+        return self._text[self._bounds[index]:self._bounds[index + 1]]
+
+    def add_verbose_answer(self, verbose_answer, offset=None):
+        """
+        Appends the answer of the next chunk. `offset` is the chunk's start in seconds; when chunks overlap it
+        lies before the current end, and the segments and words repeated by the overlap are dropped. Without an
+        offset the chunk directly follows the previous one and is appended as it is.
+        """
+        if offset is None:
+            # Whisper's end timestamps may run past the chunk's duration, which is no overlap.
+            offset = self.duration
+            new_segments = [(segment["start"] + offset, segment["end"] + offset, segment["text"])
+                            for segment in verbose_answer["segments"]]
+        else:
+            seam = self._ends[-1] if len(self) else offset
+            new_segments = [(segment["start"] + offset, segment["end"] + offset, segment["text"])
+                            for segment in verbose_answer["segments"] if segment["end"] + offset > seam]
 
-        text = text[1:] if text[0] == " " else text
+            if offset < seam and len(self) and new_segments:
+                previous_text = self._text[self._bounds[max(len(self) - 3, 0)]:]
+                start, end, text = new_segments[0]
+                new_segments[0] = (start, end, self._strip_repeated_words(previous_text, text))
 
+        self._append(new_segments)
+        self.duration = max(self.duration, offset + verbose_answer["duration"])
+        if self.verbose_answers is not None:
+            self.verbose_answers.append(verbose_answer)
+
+    @classmethod
+    def _strip_repeated_words(cls, previous_text, text):
+        previous_words = cls._normalize(previous_text.split()[-cls.MAX_SEAM_WORDS:])
+        words = text.split()
+        normalized_words = cls._normalize(words[:cls.MAX_SEAM_WORDS])
+
+        # A single repeated word is too likely to be a coincidence.
+        for length in range(min(len(previous_words), len(normalized_words)), 1, -1):
+            if previous_words[-length:] == normalized_words[:length]:
+                return " " + " ".join(words[length:]) if len(words) > length else ""
         return text
 
+    @staticmethod
+    def _normalize(words):
+        return [re.sub(r"\W", "", word).lower() for word in words]
+
+    def segments(self):
+        for index in range(len(self)):
+            yield self._starts[index], self._ends[index], self._segment_text(index)
+
+    def get_plain_text(self):
+        return self._text[1:] if self._text.startswith(" ") else self._text
+
     def get_json(self):
-        return self._result
+        return {
+            "segments": [{"start": start, "end": end, "text": text} for start, end, text in self.segments()]
+        }
+
+    @staticmethod
+    def _format_timestamp(seconds, separator):
+        milliseconds = round(seconds * 1000)
+        hours, milliseconds = divmod(milliseconds, 3600000)
+        minutes, milliseconds = divmod(milliseconds, 60000)
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+    def _render_cues(self, separator, numbered):
+        cues = []
+        for start, end, text in self.segments():
+            text = text.strip()
+            if not text:
+                continue
+            timing = f"{self._format_timestamp(start, separator)} --> {self._format_timestamp(end, separator)}"
+            cues.append(f"{len(cues) + 1}\n{timing}\n{text}\n" if numbered else f"{timing}\n{text}\n")
+        return "\n".join(cues)
+
+    def get_srt(self):
+        return self._render_cues(",", numbered=True)
+
+    def get_vtt(self):
+        return "WEBVTT\n\n" + self._render_cues(".", numbered=False)
+
+    def to_dict(self):
+        return {
+            "duration": self.duration,
+            "starts": self._starts.tolist(),
+            "ends": self._ends.tolist(),
+            "bounds": self._bounds.tolist(),
+            "text": self._text
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls.__new__(cls)
+        result.duration = data["duration"]
+        result.verbose_answers = None
+        if "segments" in data:
+            # Entries cached before segments were stored as arrays.
+            result._starts, result._ends, result._bounds, result._text = array("d"), array("d"), array("q", [0]), ""
+            result._append([(segment["start"], segment["end"], segment["text"]) for segment in data["segments"]])
+        else:
+            result._starts = array("d", data["starts"])
+            result._ends = array("d", data["ends"])
+            result._bounds = array("q", data["bounds"])
+            result._text = data["text"]
+        return result
@@ -1,7 +1,13 @@
+import asyncio
+import os
+
 from .job import BaseJob
-from utils import AudioHelper
-import openai
+from utils import AudioHelper, StreamingTranscoder
 from job_manager.transcription_result import TranscriptionResult
+from job_manager.transcription_cache import transcription_cache
+from job_manager.single_flight import SingleFlight
+from job_manager.job_store import job_store
+from metrics import metrics
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,56 +16,249 @@ logger = logging.getLogger(__name__)
 
 class VoiceJob(BaseJob):
     SIZE_LIMIT = 20
+    MAX_CONCURRENT_CHUNKS = 4
+    MAX_CHUNK_RETRIES = 3
+    RETRY_DELAY = 1
+    CHUNK_OVERLAP = 1000
+    STREAMING = os.getenv("STREAMING_PIPELINE", "0") == "1"
+    COMPACTION = os.getenv("AUDIO_COMPACTION", "1") == "1"
+    COMPACT_SAMPLE_RATE = int(os.getenv("COMPACT_SAMPLE_RATE", 16000))
+    COMPACT_BITRATE = os.getenv("COMPACT_BITRATE", "32k")
+    # With a progress callback, audio longer than PROGRESS_MIN_DURATION (seconds) is cut into chunks that start
+    # this short and double up to PROGRESS_MAX_CHUNK, so partial text appears early regardless of SIZE_LIMIT.
+    # Shorter notes stay one request, since every extra chunk costs a call and a seam.
+    PROGRESS_FIRST_CHUNK = 30
+    PROGRESS_MAX_CHUNK = 300
+    PROGRESS_MIN_DURATION = 3 * PROGRESS_MAX_CHUNK
+    in_flight = SingleFlight()
 
-    def __init__(self, client_handler, message):
-        super().__init__(client_handler, message)
-        self._job_directory = self._create_job_directory()
+    def __init__(self, client_handler, message, max_concurrent_chunks=None, streaming=None, cache=None,
+                 job_id=None, store=None, backend=None, progress_callback=None):
+        super().__init__(client_handler, message, job_id)
         self._prompt = ""
         self._client_handler = client_handler
+        self._max_concurrent_chunks = max_concurrent_chunks or self.MAX_CONCURRENT_CHUNKS
+        self._streaming = self.STREAMING if streaming is None else streaming
+        self._cache = cache or transcription_cache
+        self._store = store or job_store
+        self._backend = backend or client_handler.transcription_backend
+        # Awaited as progress_callback(stage, completed, total, text) while downloading ("download") and as
+        # chunks complete ("transcribe"), with the text of the leading chunks transcribed so far.
+        self._progress_callback = progress_callback
+        self._checkpoint_key = None
+        self._job_directory = None
+
+    @property
+    def _progressive(self):
+        media_file = getattr(self._message, "file", None)
+        duration = getattr(media_file, "duration", None) or 0
+        return self._progress_callback is not None and duration > self.PROGRESS_MIN_DURATION
+
+    @property
+    def priority(self):
+        # Short voice notes are queued ahead of long files.
+        media_file = getattr(self._message, "file", None)
+        return getattr(media_file, "duration", None) or 0
 
     def get_file_path(self):
         return self._job_directory + "/" + self._id + ".ogg"
 
     async def process_job(self) -> TranscriptionResult:
-        downloaded_media_path = await self.manage_download()
-        converted_media_path = await AudioHelper.convert_media_to_mp3(downloaded_media_path)
-
-        size = await AudioHelper.get_size_mb(converted_media_path)
-
-        result = None
-        if size > self.SIZE_LIMIT:
-            logger.info(f"Audio file is too large ({size} MB), splitting into smaller segments")
-            audio_segments = AudioHelper.split_audio(converted_media_path)
-            for audio_segment in audio_segments:
-                verbose_answer = await openai.Audio.atranscribe("whisper-1", audio_segment, response_format="verbose_json",
-                                                                prompt=self._prompt)
-                if result is None:
-                    result = TranscriptionResult(verbose_answer)
-                else:
-                    result.add_verbose_answer(verbose_answer)
+        media_key = self._cache.media_key(self._message, self._backend)
+        return await self.in_flight.do(media_key, lambda: self._process_job(media_key))
 
-            print(result.get_json())
+    async def _process_job(self, media_key) -> TranscriptionResult:
+        result = await self._cache.get(media_key)
+        if result is not None:
+            return result
 
+        # Chunk boundaries differ between the pipelines, so their checkpoints must not be mixed.
+        pipeline = ("stream" if self._streaming else "file") + (":compact" if self.COMPACTION else "")
+        pipeline += ":progressive" if self._progressive else ""
+        self._checkpoint_key = f"{media_key or self._id}:{pipeline}"
+        if self._streaming:
+            result = await self.process_stream()
         else:
-            result = await self.transcribe()
+            result = await self.process_file()
 
+        await self._cache.put(media_key, result)
+        await self._store.clear_chunks(self._checkpoint_key)
         return result
 
+    async def process_file(self) -> TranscriptionResult:
+        media_file = getattr(self._message, "file", None)
+        self._job_directory = await self._create_job_directory(getattr(media_file, "size", None))
+        try:
+            return await self._process_file()
+        finally:
+            await self._remove_job_directory()
+
+    async def _process_file(self) -> TranscriptionResult:
+        async with metrics.stage("download", self._id):
+            downloaded_media_path = await self.manage_download()
+        metrics.inc("telekit_bytes_total", os.path.getsize(downloaded_media_path), direction="download")
+        await self._enforce_quota()
+
+        content_key = await asyncio.to_thread(self._cache.file_key, downloaded_media_path, self._backend)
+        result = await self._cache.get(content_key)
+        if result is not None:
+            return result
+
+        async with metrics.stage("convert", self._id):
+            if self.COMPACTION:
+                upload_path = await AudioHelper.compact_audio(downloaded_media_path, self.COMPACT_SAMPLE_RATE,
+                                                              self.COMPACT_BITRATE)
+            else:
+                upload_path = await AudioHelper.convert_media_to_mp3(downloaded_media_path)
+
+        size = await AudioHelper.get_size_mb(upload_path)
+
+        if size > self.SIZE_LIMIT or self._progressive:
+            logger.info(f"Splitting audio file ({size} MB) into smaller segments")
+            async with metrics.stage("split", self._id):
+                audio_segments = await AudioHelper.split_audio(
+                    upload_path, self.SIZE_LIMIT, overlap=self.CHUNK_OVERLAP,
+                    bitrate=self.COMPACT_BITRATE if self.COMPACTION else None,
+                    first_chunk=self.PROGRESS_FIRST_CHUNK * 1000 if self._progressive else None,
+                    max_chunk=self.PROGRESS_MAX_CHUNK * 1000)
+            result = await self.transcribe_segments(audio_segments)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(result.get_json())
+        else:
+            result = await self.transcribe(upload_path)
+
+        await self._cache.put(content_key, result)
+        return result
+
+    async def process_stream(self) -> TranscriptionResult:
+        """
+        Streams the media from Telegram through ffmpeg and transcribes each MP3 chunk as soon as it is
+        produced, without touching the disk.
+        """
+        if not (self._message.voice or self._message.video_note):
+            raise TypeError("Message is not a voice or video note")
+
+        semaphore = asyncio.Semaphore(self._max_concurrent_chunks)
+        bitrate = self.COMPACT_BITRATE if self.COMPACTION else "64k"
+        chunk_size, first_chunk_size = self.SIZE_LIMIT * 1024 * 1024, None
+        if self._progressive:
+            bytes_per_second = AudioHelper.parse_bitrate(bitrate) // 8
+            chunk_size = min(chunk_size, bytes_per_second * self.PROGRESS_MAX_CHUNK)
+            first_chunk_size = bytes_per_second * self.PROGRESS_FIRST_CHUNK
+        transcoder = StreamingTranscoder(chunk_size, bitrate,
+                                         self.COMPACT_SAMPLE_RATE if self.COMPACTION else None,
+                                         first_chunk_size=first_chunk_size)
+        tasks = []
+        verbose_answers = []
+        try:
+            async for buffer in transcoder.transcode(self._client_handler.iter_media(self._message), self._id):
+                verbose_answers.append(None)
+                tasks.append(asyncio.ensure_future(self._track_chunk(
+                    len(tasks), self._transcribe_buffer(len(tasks), buffer, semaphore), verbose_answers)))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        async with metrics.stage("merge", self._id):
+            return self._merge_answers(verbose_answers)
+
     async def manage_download(self):
-        if not self._message.voice:
-            raise TypeError("Message is not a voice message")
+        if not (self._message.voice or self._message.video_note):
+            raise TypeError("Message is not a voice or video note")
 
         filename = self._id + ".ogg"
         client = self._client_handler
 
-        return await client.download_media(self._message, file=self._job_directory + "/" + filename)
+        return await client.download_media(self._message, file=self._job_directory + "/" + filename,
+                                           progress_callback=self._report_download)
+
+    async def _report_download(self, received, total):
+        if self._progress_callback:
+            await self._progress_callback("download", received, total, "")
 
-    async def transcribe(self) -> TranscriptionResult:
+    async def transcribe(self, file_path=None) -> TranscriptionResult:
 
-        with open(self.get_file_path(), 'rb') as file:
-            verbose_answer = await openai.Audio.atranscribe("whisper-1", file, response_format="verbose_json",
-                                                            prompt=self._prompt)
+        file_path = file_path or self.get_file_path()
+        metrics.inc("telekit_bytes_total", os.path.getsize(file_path), direction="upload")
+        with open(file_path, 'rb') as file:
+            async with metrics.stage("api_call", self._id, backend=self._backend.name):
+                verbose_answer = await self._backend.transcribe(file, prompt=self._prompt)
 
         result = TranscriptionResult(verbose_answer)
 
         return result
+
+    async def transcribe_segments(self, audio_segments) -> TranscriptionResult:
+        """
+        Transcribes the (start_ms, segment) pairs concurrently, at most `max_concurrent_chunks` at a time.
+
+        The answers are merged in the original segment order at their start offsets, so timestamps stay
+        correct even if the chunks finish out of order.
+        """
+        semaphore = asyncio.Semaphore(self._max_concurrent_chunks)
+        offsets = [start / 1000 for start, _ in audio_segments]
+        verbose_answers = [None] * len(audio_segments)
+        await asyncio.gather(*[
+            self._track_chunk(index, self._transcribe_segment(index, audio_segment, semaphore), verbose_answers,
+                              offsets, len(audio_segments))
+            for index, (_, audio_segment) in enumerate(audio_segments)
+        ])
+
+        async with metrics.stage("merge", self._id):
+            return self._merge_answers(verbose_answers, offsets)
+
+    async def _track_chunk(self, index, coroutine, verbose_answers, offsets=None, total=None):
+        verbose_answers[index] = await coroutine
+        if not self._progress_callback:
+            return
+
+        completed = sum(verbose_answer is not None for verbose_answer in verbose_answers)
+        leading = 0
+        while leading < len(verbose_answers) and verbose_answers[leading] is not None:
+            leading += 1
+        text = self._merge_answers(verbose_answers[:leading], offsets).get_plain_text() if leading else ""
+        await self._progress_callback("transcribe", completed, total, text)
+
+    @staticmethod
+    def _merge_answers(verbose_answers, offsets=None) -> TranscriptionResult:
+        result = TranscriptionResult(verbose_answers[0])
+        for index, verbose_answer in enumerate(verbose_answers[1:], start=1):
+            result.add_verbose_answer(verbose_answer, offsets[index] if offsets else None)
+
+        return result
+
+    async def _transcribe_segment(self, index, audio_segment, semaphore):
+        async with semaphore:
+            verbose_answer = await self._store.get_chunk(self._checkpoint_key, index)
+            if verbose_answer is None:
+                if self.COMPACTION:
+                    buffer = await AudioHelper.export_segment(audio_segment, f"{self._id}_{index}.ogg", "ogg",
+                                                              self.COMPACT_BITRATE)
+                else:
+                    buffer = await AudioHelper.export_segment(audio_segment, f"{self._id}_{index}.mp3")
+                verbose_answer = await self._transcribe_with_retry(index, buffer)
+            return verbose_answer
+
+    async def _transcribe_buffer(self, index, buffer, semaphore):
+        async with semaphore:
+            verbose_answer = await self._store.get_chunk(self._checkpoint_key, index)
+            if verbose_answer is None:
+                verbose_answer = await self._transcribe_with_retry(index, buffer)
+            return verbose_answer
+
+    async def _transcribe_with_retry(self, index, buffer):
+        for attempt in range(1, self.MAX_CHUNK_RETRIES + 1):
+            buffer.seek(0)
+            try:
+                metrics.inc("telekit_bytes_total", buffer.getbuffer().nbytes, direction="upload")
+                async with metrics.stage("api_call", self._id, backend=self._backend.name):
+                    verbose_answer = await self._backend.transcribe(buffer, prompt=self._prompt)
+                await self._store.save_chunk(self._checkpoint_key, index, verbose_answer)
+                return verbose_answer
+            except self._backend.retryable_errors as e:
+                if attempt == self.MAX_CHUNK_RETRIES:
+                    raise
+                logger.warning(f"Chunk {index} failed ({e}), retrying ({attempt}/{self.MAX_CHUNK_RETRIES})")
+                await asyncio.sleep(self.RETRY_DELAY * attempt)
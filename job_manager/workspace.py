@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WorkspaceManager:
+    """
+        Manages the per-job scratch directories and keeps them within a disk quota.
+
+        Small media can be placed on a RAM-backed directory (e.g. /dev/shm) when `scratch_root` is set; the
+        job directories go into a SCRATCH_SUBDIRECTORY of it, so other programs' files there are never touched.
+        Directories of finished jobs are removed by `release`; when the quota is exceeded, the oldest
+        directories that no job in this process is using are evicted first.
+
+        Methods:
+        --------
+        create(job_id, expected_size=None) -> str:
+            Creates the directory of a job and returns its path.
+
+        release(job_id):
+            Removes the directory of a job and everything in it.
+
+        enforce_quota():
+            Evicts the oldest unused directories until the total size fits the quota. Jobs call it again once
+            their media is downloaded, so the new file counts against the quota.
+
+        The directory scans and removals run on a worker thread, off the event loop.
+    """
+    # Directories this process doesn't own may belong to a job of another shard, so they are only
+    # evicted once they have been idle for a while.
+    FOREIGN_MIN_AGE = 3600
+    SCRATCH_SUBDIRECTORY = "telekit-jobs"
+
+    def __init__(self, root="jobs", quota=1024 * 1024 * 1024, scratch_root=None, scratch_file_limit=5 * 1024 * 1024):
+        self.root = root
+        self.quota = quota
+        # Only directories under roots the manager owns are counted and evicted.
+        self.scratch_root = os.path.join(scratch_root, self.SCRATCH_SUBDIRECTORY) if scratch_root else None
+        self.scratch_file_limit = scratch_file_limit
+        self._active = {}
+
+    async def create(self, job_id, expected_size=None) -> str:
+        root = self.root
+        if self.scratch_root and expected_size is not None and expected_size <= self.scratch_file_limit:
+            root = self.scratch_root
+
+        job_directory = os.path.join(root, job_id)
+        await asyncio.to_thread(os.makedirs, job_directory, exist_ok=True)
+        self._active[job_id] = job_directory
+        await self.enforce_quota()
+        return job_directory
+
+    async def release(self, job_id):
+        job_directory = self._active.pop(job_id, None)
+        if job_directory:
+            await asyncio.to_thread(shutil.rmtree, job_directory, ignore_errors=True)
+
+    async def enforce_quota(self):
+        # The active set is copied on the loop, the thread only reads the copy.
+        await asyncio.to_thread(self._enforce_quota, set(self._active.values()))
+
+    def _enforce_quota(self, active):
+        directories = []
+        for root in {self.root, self.scratch_root} - {None}:
+            if not os.path.isdir(root):
+                continue
+            for entry in os.scandir(root):
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append((entry.stat().st_mtime, entry.path, self._get_size(entry.path)))
+
+        total_size = sum(size for _, _, size in directories)
+        if total_size <= self.quota:
+            return
+
+        now = time.time()
+        for mtime, path, size in sorted(directories):
+            if path in active:
+                continue
+            if now - mtime < self.FOREIGN_MIN_AGE:
+                continue
+            logger.info(f"Evicting job directory {path} to stay within the disk quota")
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+            if total_size <= self.quota:
+                return
+
+        logger.warning(f"Job directories use {total_size / (1024 * 1024):.1f} MB, over the quota")
+
+    @staticmethod
+    def _get_size(path):
+        size = 0
+        for directory, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(directory, filename))
+                except OSError:
+                    pass
+        return size
+
+
+workspace = WorkspaceManager(
+    quota=int(os.getenv("WORKSPACE_QUOTA_MB", 1024)) * 1024 * 1024,
+    scratch_root=os.getenv("WORKSPACE_SCRATCH_DIR") or None)
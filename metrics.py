@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("telekit.trace")
+
+
+class Histogram:
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, float("inf"))
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self):
+        return {
+            "buckets": dict(zip(map(str, self.buckets), self.counts)),
+            "sum": self.total,
+            "count": self.count,
+        }
+
+
+class MetricsRegistry:
+    """
+        Process-wide counters, histograms and gauges, rendered in the Prometheus text format.
+
+        Methods:
+        --------
+        inc(name, value=1, **labels):
+            Increments a counter.
+
+        observe(name, value, **labels):
+            Records a value in a histogram.
+
+        register_gauges(name, collect):
+            Registers a callable returning a dict of gauge values, read at every scrape. Nested dicts
+            become labels.
+
+        stage(stage, job_id=None, **labels):
+            Async context manager timing a processing stage into telekit_stage_seconds, optionally as a span.
+
+        render() -> str:
+            Returns all metrics in the Prometheus text format.
+    """
+
+    def __init__(self, tracing=None):
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self.tracing = tracing
+        self._tracer = None
+        if tracing == "otel":
+            try:
+                from opentelemetry import trace
+                self._tracer = trace.get_tracer("telekit")
+            except ImportError:
+                logger.warning("TRACING=otel requires opentelemetry-api, falling back to log spans")
+                self.tracing = "log"
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def register_gauges(self, name, collect):
+        self._gauges[name] = collect
+
+    @asynccontextmanager
+    async def stage(self, stage, job_id=None, **labels):
+        started_at = time.monotonic()
+        span = None
+        if self._tracer is not None:
+            span = self._tracer.start_span(stage, attributes={"job.id": job_id or "", **labels})
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started_at
+            self.observe("telekit_stage_seconds", duration, stage=stage, **labels)
+            if span is not None:
+                span.end()
+            elif self.tracing == "log":
+                trace_logger.info(json.dumps({"trace_id": job_id, "span": stage, "duration": round(duration, 4),
+                                              **labels}))
+
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.total}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+
+        for name, collect in sorted(self._gauges.items()):
+            try:
+                values = collect()
+            except Exception:
+                logger.exception(f"Collecting {name} failed")
+                continue
+            self._render_gauges(lines, name, values, ())
+
+        return "\n".join(lines) + "\n"
+
+    def _render_gauges(self, lines, name, values, labels):
+        for key, value in values.items():
+            if isinstance(value, dict):
+                if value and all(isinstance(item, dict) for item in value.values()):
+                    # {"client": {"a": {"requests": 1}}} -> name_requests{client="a"} 1
+                    for label, item in value.items():
+                        self._render_gauges(lines, name, item, labels + ((key, str(label)),))
+                else:
+                    # {"running_per_client": {"a": 1}} -> name_running_per_client{key="a"} 1
+                    for label, item in value.items():
+                        if isinstance(item, (int, float)) and not isinstance(item, bool):
+                            lines.append(f"{name}_{key}{self._format_labels(labels + (('key', str(label)),))} {item}")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"{name}_{key}{self._format_labels(labels)} {value}")
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server answering GET /metrics on the running event loop.
+    """
+
+    def __init__(self, registry, port, host="0.0.0.0"):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on {self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode(errors="ignore").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+metrics = MetricsRegistry(tracing=os.getenv("TRACING") or None)
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import time
+
+from telethon.errors import FloodWaitError
+from telethon.utils import get_peer_id
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class OutboundScheduler:
+    """
+        Paces the outgoing requests of one client with a client-wide and a per-peer token bucket.
+
+        FloodWaitError pauses the client's bucket and retries the request transparently. Edits of the same
+        message that are still waiting for a token are coalesced: only the latest text is sent, and the
+        callers whose edit was superseded get None. A cancelled caller's edit is dropped unless a later edit was
+        merged into it, which is then still sent.
+
+        Methods:
+        --------
+        call(peer_id, request) -> Any:
+            Awaits request() once the client and the peer have a free token.
+
+        edit(peer_id, message_id, request) -> Any:
+            Same as call, but coalesces with pending edits of the same message.
+
+        get_metrics() -> dict:
+            Returns request counts, queue latency, coalesced edits and flood waits.
+    """
+    MAX_FLOOD_RETRIES = 3
+
+    def __init__(self, client_rate=20, client_burst=20, peer_rate=1, peer_burst=3, max_flood_wait=300):
+        self._client_bucket = TokenBucket(client_rate, client_burst)
+        self._peer_rate = peer_rate
+        self._peer_burst = peer_burst
+        self._peer_buckets = {}
+        self._pending_edits = {}
+        self.max_flood_wait = max_flood_wait
+
+        self._requests = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._coalesced = 0
+        self._flood_waits = 0
+
+    async def call(self, peer_id, request):
+        await self._acquire(get_peer_id(peer_id))
+        return await self._run(request)
+
+    async def edit(self, peer_id, message_id, request):
+        peer_id = get_peer_id(peer_id)
+        key = (peer_id, message_id)
+        future = asyncio.get_running_loop().create_future()
+
+        entry = self._pending_edits.get(key)
+        if entry is not None:
+            superseded = entry[1]
+            entry[0], entry[1] = request, future
+            if not superseded.done():
+                superseded.set_result(None)
+            self._coalesced += 1
+            return await future
+
+        entry = [request, future]
+        self._pending_edits[key] = entry
+        # The edit is sent by its own task, so cancelling this caller doesn't lose a later edit merged into it.
+        sender = asyncio.ensure_future(self._send_edit(key, entry))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if entry[1] is future:
+                # Nobody else waits for this edit, drop it.
+                if self._pending_edits.get(key) is entry:
+                    del self._pending_edits[key]
+                sender.cancel()
+            raise
+
+    async def _send_edit(self, key, entry):
+        try:
+            try:
+                await self._acquire(key[0])
+            finally:
+                if self._pending_edits.get(key) is entry:
+                    del self._pending_edits[key]
+            # The edit that is sent is the latest one queued for this message, not necessarily the first.
+            result = await self._run(entry[0])
+        except asyncio.CancelledError:
+            if not entry[1].done():
+                entry[1].cancel()
+            raise
+        except Exception as e:
+            if not entry[1].done():
+                entry[1].set_exception(e)
+        else:
+            if not entry[1].done():
+                entry[1].set_result(result)
+
+    async def _acquire(self, peer_id):
+        queued_at = time.monotonic()
+        await self._client_bucket.acquire()
+        await self._get_peer_bucket(peer_id).acquire()
+
+        latency = time.monotonic() - queued_at
+        self._requests += 1
+        self._total_latency += latency
+        self._max_latency = max(self._max_latency, latency)
+
+    async def _run(self, request):
+        for attempt in range(self.MAX_FLOOD_RETRIES + 1):
+            try:
+                return await request()
+            except FloodWaitError as e:
+                if attempt == self.MAX_FLOOD_RETRIES or e.seconds > self.max_flood_wait:
+                    raise
+                self._flood_waits += 1
+                logger.warning(f"Flood wait of {e.seconds}s, pausing outgoing requests")
+                self._client_bucket.pause(e.seconds)
+                await asyncio.sleep(e.seconds)
+
+    def _get_peer_bucket(self, peer_id):
+        bucket = self._peer_buckets.get(peer_id)
+        if bucket is None:
+            bucket = self._peer_buckets[peer_id] = TokenBucket(self._peer_rate, self._peer_burst)
+        return bucket
+
+    def get_metrics(self):
+        return {
+            "requests": self._requests,
+            "average_queue_latency": self._total_latency / self._requests if self._requests else 0.0,
+            "max_queue_latency": self._max_latency,
+            "pending_edits": len(self._pending_edits),
+            "coalesced_edits": self._coalesced,
+            "flood_waits": self._flood_waits,
+        }
+
+
+def create_outbound_scheduler():
+    return OutboundScheduler(client_rate=float(os.getenv("OUTBOUND_RATE", 20)),
+                             peer_rate=float(os.getenv("OUTBOUND_PEER_RATE", 1)))
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+import zlib
+
+from client_registry import ClientRegistryWatcher, load_client_configs
+from control import ClientSupervisor, serve_metrics
+
+logging.basicConfig(level=logging.INFO)
+
+
+def shard_of(client_config, shard_count):
+    # Stable across processes and registry edits, unlike hash() or the position in clients.json.
+    return zlib.crc32(client_config.get("session_name", "").encode("utf-8")) % shard_count
+
+
+def run_shard(index, client_configs, connect_concurrency, heartbeat, heartbeat_interval, metrics_port=0,
+              registry_path=None, shard_count=1):
+    """
+    Entry point of a shard process: runs a ClientSupervisor for its share of the clients until SIGTERM.
+    With `registry_path`, the shard follows changes to its share of the registry.
+    """
+    # Ctrl+C reaches the whole process group; shutdown is coordinated by the parent instead.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(_run_shard(index, client_configs, connect_concurrency, heartbeat, heartbeat_interval,
+                               metrics_port, registry_path, shard_count))
+    except asyncio.CancelledError:
+        pass
+    logging.info(f"Shard {index} stopped")
+
+
+async def _run_shard(index, client_configs, connect_concurrency, heartbeat, heartbeat_interval, metrics_port,
+                     registry_path, shard_count):
+    in_shard = lambda config: shard_of(config, shard_count) == index
+    if registry_path:
+        # A restarted shard picks up the registry as it is now, not as it was when the program started.
+        try:
+            client_configs = [config for config in load_client_configs(registry_path) if in_shard(config)]
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't read the client registry ({e}), using the clients the shard started with")
+
+    supervisor = ClientSupervisor(client_configs, max_concurrent_connects=connect_concurrency)
+    if metrics_port:
+        await serve_metrics(supervisor, metrics_port + index)
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    background_tasks = [asyncio.ensure_future(_beat(heartbeat, heartbeat_interval))]
+    if registry_path:
+        watcher = ClientRegistryWatcher(registry_path, supervisor.apply, select=in_shard)
+        background_tasks.append(asyncio.ensure_future(watcher.watch()))
+    logging.info(f"Shard {index} running {len(client_configs)} client(s)")
+    try:
+        await supervisor.run()
+    finally:
+        for task in background_tasks:
+            task.cancel()
+
+
+async def _beat(heartbeat, interval):
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(interval)
+
+
+class ShardSupervisor:
+    """
+        Parent process supervisor that spreads clients over several worker processes.
+
+        Each shard runs its own event loop and ClientSupervisor. Shards that exit or stop sending
+        heartbeats are restarted; SIGINT/SIGTERM stops all shards gracefully.
+
+        Attributes:
+        -----------
+        shard_count: int
+            Number of worker processes. Clients are assigned by a hash of their session name, so every shard
+            keeps its clients when the registry changes.
+
+        Methods:
+        --------
+        run():
+            Starts the shards and supervises them until a shutdown signal is received.
+    """
+    HEARTBEAT_INTERVAL = 5
+    HEARTBEAT_TIMEOUT = 60
+    SHUTDOWN_TIMEOUT = 15
+
+    def __init__(self, client_configs, shard_count, connect_concurrency=5, metrics_port=0, registry_path=None):
+        # Clients added at runtime need shards to land on, so the count is only capped when nothing is watched.
+        self.shard_count = max(1, shard_count if registry_path else min(shard_count, len(client_configs)))
+        self.connect_concurrency = connect_concurrency
+        self.metrics_port = metrics_port
+        self.registry_path = registry_path
+        self._assignments = [[config for config in client_configs if shard_of(config, self.shard_count) == i]
+                             for i in range(self.shard_count)]
+        self._context = multiprocessing.get_context("spawn")
+        self._processes = [None] * self.shard_count
+        self._heartbeats = [self._context.Value("d", 0.0) for _ in range(self.shard_count)]
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for index in range(self.shard_count):
+            self._start_shard(index)
+
+        try:
+            while not self._stopping:
+                time.sleep(self.HEARTBEAT_INTERVAL)
+                self._check_shards()
+        finally:
+            self._stop_shards()
+
+    def _request_stop(self, signum, frame):
+        logging.info("Stopping shards")
+        self._stopping = True
+
+    def _start_shard(self, index):
+        self._heartbeats[index].value = time.time()
+        process = self._context.Process(
+            target=run_shard, name=f"telekit-shard-{index}",
+            args=(index, self._assignments[index], self.connect_concurrency, self._heartbeats[index],
+                  self.HEARTBEAT_INTERVAL, self.metrics_port, self.registry_path, self.shard_count))
+        process.start()
+        self._processes[index] = process
+        logging.info(f"Started shard {index} (pid {process.pid})")
+
+    def _check_shards(self):
+        for index, process in enumerate(self._processes):
+            if self._stopping:
+                return
+            if not process.is_alive():
+                logging.warning(f"Shard {index} exited with code {process.exitcode}, restarting")
+            elif time.time() - self._heartbeats[index].value > self.HEARTBEAT_TIMEOUT:
+                logging.warning(f"Shard {index} missed its heartbeat, restarting")
+                self._terminate(process)
+            else:
+                continue
+            self._start_shard(index)
+
+    def _stop_shards(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                self._terminate(process)
+
+    def _terminate(self, process):
+        if process.is_alive():
+            process.terminate()
+        process.join(self.SHUTDOWN_TIMEOUT)
+        if process.is_alive():
+            logging.warning(f"{process.name} did not stop in time, killing it")
+            process.kill()
+            process.join()
@@ -1,17 +1,127 @@
-import math
+import asyncio
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 
 from pydub import AudioSegment
+from pydub.silence import detect_silence
+from pydub.utils import mediainfo
+
+logger = logging.getLogger(__name__)
+
+
+class AudioEngine:
+    """
+        Thread pool that runs blocking pydub/ffmpeg work off the event loop.
+
+        Attributes:
+        -----------
+        max_workers: int
+            Number of worker threads doing audio work at the same time.
+
+        Methods:
+        --------
+        run(func, *args, **kwargs):
+            Runs func in the pool and awaits its result. Cancelling the awaiting task cancels the job if it
+            has not started yet.
+
+        get_metrics() -> dict:
+            Returns the current queue depth, active and completed job counters.
+
+        shutdown(cancel_pending):
+            Stops the pool, optionally cancelling queued jobs.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audio")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._cancelled = 0
+
+    async def run(self, func, *args, **kwargs):
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(self._call, func, args, kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if future.cancelled():
+                with self._lock:
+                    self._queued -= 1
+                    self._cancelled += 1
+            raise
+
+    def _call(self, func, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+
+    def get_metrics(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queue_depth": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+            }
+
+    def shutdown(self, cancel_pending=True):
+        self._executor.shutdown(wait=False, cancel_futures=cancel_pending)
+
+
+audio_engine = AudioEngine(int(os.getenv("AUDIO_WORKERS", 2)))
 
 
 class AudioHelper:
     @staticmethod
     async def convert_media_to_mp3(file_path):
+        return await audio_engine.run(AudioHelper._convert_media_to_mp3, file_path)
+
+    @staticmethod
+    def _convert_media_to_mp3(file_path):
         input_format = os.path.splitext(file_path)[1][1:]
         output_path = os.path.splitext(file_path)[0] + '.mp3'
         AudioSegment.from_file(file_path, input_format).export(output_path, format='mp3')
         return output_path
 
+    @staticmethod
+    async def compact_audio(file_path, sample_rate=16000, bitrate="32k"):
+        return await audio_engine.run(AudioHelper._compact_audio, file_path, sample_rate, bitrate)
+
+    @staticmethod
+    def _compact_audio(file_path, sample_rate=16000, bitrate="32k"):
+        """
+        Re-encodes the media as mono Opus at a speech sample rate, or returns the file untouched when it is
+        already a mono Opus stream at or below the target bitrate (e.g. a Telegram voice note).
+        """
+        info = mediainfo(file_path)
+        try:
+            source_bitrate = int(float(info.get("bit_rate") or 0))
+        except ValueError:
+            source_bitrate = 0
+        target_bitrate = AudioHelper.parse_bitrate(bitrate)
+        if (info.get("codec_name") == "opus" and str(info.get("channels")) == "1"
+                and 0 < source_bitrate <= target_bitrate):
+            return file_path
+
+        output_path = os.path.splitext(file_path)[0] + '.compact.ogg'
+        AudioSegment.from_file(file_path).export(output_path, format='ogg', codec='libopus', bitrate=bitrate,
+                                                 parameters=["-ac", "1", "-ar", str(sample_rate)])
+        return output_path
+
     @staticmethod
     async def get_size_mb(file_path):
         size_in_bytes = os.path.getsize(file_path)
@@ -19,22 +129,237 @@ class AudioHelper:
         return size_in_mb
 
     @staticmethod
-    def split_audio(file_path, max_size=2) -> list[AudioSegment]:
-        audio = AudioSegment.from_mp3(file_path)
+    async def split_audio(file_path, max_size=20, overlap=0, bitrate=None, first_chunk=None,
+                          max_chunk=None) -> list[tuple[int, AudioSegment]]:
+        return await audio_engine.run(AudioHelper._split_audio, file_path, max_size, overlap, bitrate,
+                                      first_chunk, max_chunk)
+
+    @staticmethod
+    def _split_audio(file_path, max_size=20, overlap=0, bitrate=None, first_chunk=None, max_chunk=None,
+                     search_window=10000, min_silence_len=400, silence_margin=16) -> list[tuple[int, AudioSegment]]:
+        """
+        Splits an audio file into (start_ms, fragment) pairs whose encoded size stays under max_size MB.
+
+        Fragment lengths are derived from the file's actual encoded bitrate, or from `bitrate` (e.g. "32k")
+        when the fragments are re-encoded at it and that is higher. Each cut is moved back to the middle of
+        the last silence found within `search_window` ms before the target boundary, and every fragment but
+        the last is extended by `overlap` ms past its cut.
+
+        With `first_chunk` (ms), fragments start that short and double in length up to `max_chunk` ms, so the
+        first text of a long recording is available early; the size limit still applies to every fragment.
+        """
+        audio = AudioSegment.from_file(file_path)
 
         duration = len(audio)
-        fragment_duration = math.ceil(
-            (max_size * 1000 * 1024 * 1024) / audio.frame_rate / audio.sample_width / audio.channels)
+        bytes_per_ms = os.path.getsize(file_path) / max(duration, 1)
+        if bitrate:
+            # A source passed through below the export bitrate would otherwise come out up to twice as large.
+            bytes_per_ms = max(bytes_per_ms, AudioHelper.parse_bitrate(bitrate) / 8 / 1000)
+        # Keep some headroom for the re-encoding of each fragment.
+        fragment_duration = int(max_size * 1024 * 1024 * 0.95 / bytes_per_ms) - overlap
+        silence_thresh = audio.dBFS - silence_margin
         fragments = []
         start = 0
 
         while start < duration:
-            end = min(start + fragment_duration, duration)
-            fragments.append(audio[start:end])
+            target_duration = fragment_duration
+            if first_chunk:
+                target_duration = min(fragment_duration, first_chunk * 2 ** len(fragments), max_chunk or duration)
+            end = start + target_duration
+            if end >= duration:
+                fragments.append((start, audio[start:duration]))
+                break
+
+            window_start = max(start + target_duration // 2, end - search_window)
+            silences = detect_silence(audio[window_start:end], min_silence_len=min_silence_len,
+                                      silence_thresh=silence_thresh, seek_step=10)
+            if silences:
+                silence_start, silence_end = silences[-1]
+                end = window_start + (silence_start + silence_end) // 2
+
+            fragments.append((start, audio[start:min(end + overlap, duration)]))
             start = end
 
         return fragments
 
+    @staticmethod
+    def parse_bitrate(bitrate) -> int:
+        bitrate = str(bitrate).lower()
+        if bitrate.endswith("k"):
+            return int(float(bitrate[:-1]) * 1000)
+        return int(bitrate)
+
+    @staticmethod
+    async def export_segment(audio_segment, name, format='mp3', bitrate=None) -> BytesIO:
+        return await audio_engine.run(AudioHelper._export_segment, audio_segment, name, format, bitrate)
+
+    @staticmethod
+    def _export_segment(audio_segment, name, format='mp3', bitrate=None) -> BytesIO:
+        buffer = BytesIO()
+        codec = 'libopus' if format == 'ogg' else None
+        audio_segment.export(buffer, format=format, codec=codec, bitrate=bitrate)
+        buffer.name = name
+        buffer.seek(0)
+        return buffer
+
+
+class StreamingTranscoder:
+    """
+        Pipes an async stream of encoded media bytes through an ffmpeg subprocess and yields
+        constant-bitrate MP3 chunks, without writing the audio to disk or decoding it in Python.
+
+        Attributes:
+        -----------
+        chunk_size: int
+            Maximum size of a yielded chunk in bytes.
+
+        first_chunk_size: int or None
+            If set, the first chunk is cut at this size and every following one at twice the previous size,
+            up to chunk_size, so the first text of a long recording is available early.
+
+        bitrate: str
+            Target MP3 bitrate passed to ffmpeg.
+
+        sample_rate: int or None
+            Sample rate to resample to, or None to keep the source rate.
+
+        Methods:
+        --------
+        transcode(byte_stream, name) -> AsyncIterator[BytesIO]:
+            Feeds byte_stream into ffmpeg and yields named MP3 buffers of at most chunk_size bytes, each
+            cut on an MP3 frame boundary.
+    """
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, chunk_size, bitrate="64k", sample_rate=None, first_chunk_size=None):
+        self.chunk_size = chunk_size
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.first_chunk_size = first_chunk_size
+
+    def _chunk_limit(self, index):
+        if not self.first_chunk_size:
+            return self.chunk_size
+        return min(self.chunk_size, self.first_chunk_size * 2 ** min(index, 32))
+
+    async def transcode(self, byte_stream, name):
+        resample = ["-ar", str(self.sample_rate)] if self.sample_rate else []
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+            "-vn", "-ac", "1", *resample, "-b:a", self.bitrate, "-write_xing", "0", "-id3v2_version", "0",
+            "-f", "mp3", "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        feeder = asyncio.ensure_future(self._feed(process, byte_stream))
+
+        try:
+            pending = bytearray()
+            index = 0
+            while True:
+                data = await process.stdout.read(self.READ_SIZE)
+                if not data:
+                    break
+                pending.extend(data)
+                while len(pending) >= self._chunk_limit(index):
+                    cut = self._find_frame_boundary(pending, self._chunk_limit(index))
+                    yield self._make_buffer(pending[:cut], name, index)
+                    del pending[:cut]
+                    index += 1
+
+            await feeder
+            if await process.wait() != 0:
+                error = await process.stderr.read()
+                raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {error.decode(errors='ignore')}")
+            if pending:
+                yield self._make_buffer(pending, name, index)
+        finally:
+            if not feeder.done():
+                feeder.cancel()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+    @staticmethod
+    async def _feed(process, byte_stream):
+        try:
+            async for data in byte_stream:
+                process.stdin.write(data)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning("ffmpeg closed its input early")
+        finally:
+            if not process.stdin.is_closing():
+                process.stdin.close()
+
+    @staticmethod
+    def _find_frame_boundary(data, limit):
+        # An MP3 frame starts with 11 set sync bits; cut right before the last one within the limit.
+        position = limit - 1
+        while position > 1:
+            if data[position - 1] == 0xFF and data[position] & 0xE0 == 0xE0:
+                return position - 1
+            position -= 1
+        return limit
+
+    @staticmethod
+    def _make_buffer(data, name, index):
+        buffer = BytesIO(bytes(data))
+        buffer.name = f"{name}_{index}.mp3"
+        return buffer
+
+
+class EditThrottle:
+    """
+        Coalesces frequent message updates into at most one edit per `interval` seconds.
+
+        Only the latest text is sent; intermediate updates that arrive while waiting are dropped.
+
+        Methods:
+        --------
+        update(text):
+            Schedules an edit with the given text.
+
+        close():
+            Cancels the pending edit, so a final message sent afterwards is not overwritten.
+    """
+
+    def __init__(self, edit, interval=3):
+        self._edit = edit
+        self._interval = interval
+        self._latest = None
+        self._last_edit = 0
+        self._task = None
+        self._closed = False
+
+    def update(self, text):
+        if self._closed:
+            return
+
+        self._latest = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        while self._latest is not None:
+            delay = self._last_edit + self._interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            text, self._latest = self._latest, None
+            self._last_edit = time.monotonic()
+            try:
+                await self._edit(text)
+            except Exception as e:
+                logger.warning(f"Progress edit failed: {e}")
+
+    async def close(self):
+        self._closed = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
 
 from telethon.extensions import markdown
 from telethon import types